@@ -0,0 +1,79 @@
+"""
+ Compares the float (CV_32FC1) and fixed-point (CV_16SC2) rectification maps, in speed and accuracy.
+
+ Usage: python -m benchmark.remap [--config config.yaml] [--n-runs 50]
+"""
+import argparse
+import copy
+import time
+
+import cv2 as cv
+import numpy as np
+from code.utils import load_yaml_data
+from code.label import download_video_frames_and_rectify
+
+
+def get_video(config, map_type):
+    config = copy.deepcopy(config)
+    config["data"]["frame_store"] = "video" # Not to extract the frames
+    config["data"]["rect_cache"]["map_type"] = map_type
+    return download_video_frames_and_rectify(config)
+
+
+def read_first_frame(vid_path):
+    cap = cv.VideoCapture(vid_path)
+    ret, frame = cap.read()
+    cap.release()
+    if not ret:
+        print("Error: failed to load video {}".format(vid_path))
+        exit(1)
+    return frame
+
+
+def time_split_frame(v, frame, n_runs):
+    """ Time [ms] of rectifying a frame pair, with re-used output buffers as during extraction """
+    im1, im2 = v.split_frame(frame)
+    dst1 = np.empty_like(im1)
+    dst2 = np.empty_like(im2)
+    t_start = time.perf_counter()
+    for _ in range(n_runs):
+        v.split_frame(frame, dst1, dst2)
+    return 1000. * (time.perf_counter() - t_start) / n_runs
+
+
+def get_map_error(v_float, v_fixed):
+    """ Max distance [pixels] between the float maps and the fixed-point ones converted back to float """
+    error = 0.
+    for name in ["map1", "map2"]:
+        map_x = getattr(v_float, name + "_x")
+        map_y = getattr(v_float, name + "_y")
+        fixed_x, fixed_y = cv.convertMaps(np.asarray(getattr(v_fixed, name + "_x")),
+                                          np.asarray(getattr(v_fixed, name + "_y")),
+                                          cv.CV_32FC1)
+        error = max(error, float(np.max(np.hypot(map_x - fixed_x, map_y - fixed_y))))
+    return error
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark of the rectification maps')
+    parser.add_argument('--config', type=str, default='config.yaml')
+    parser.add_argument('--n-runs', type=int, default=50)
+    args = parser.parse_args()
+    config = load_yaml_data(args.config)
+    v_float = get_video(config, "float")
+    v_fixed = get_video(config, "fixed")
+    frame = read_first_frame(v_float.vid_path)
+    im_float = v_float.split_frame(frame)
+    im_fixed = v_fixed.split_frame(frame)
+    diff = np.abs(np.concatenate(im_float).astype(np.int16) - np.concatenate(im_fixed).astype(np.int16))
+    t_float = time_split_frame(v_float, frame, args.n_runs)
+    t_fixed = time_split_frame(v_fixed, frame, args.n_runs)
+    print("Image size: {}x{} (per side)".format(v_float.im_w, v_float.im_h))
+    print("float: {:.2f} ms per frame pair".format(t_float))
+    print("fixed: {:.2f} ms per frame pair ({:.2f}x)".format(t_fixed, t_float / t_fixed))
+    print("Map difference: {:.4f} pixels at most".format(get_map_error(v_float, v_fixed)))
+    print("Rectified image difference: {} max, {:.4f} mean (intensity levels)".format(diff.max(), diff.mean()))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,205 @@
+"""
+ Times the main paths of the tool on synthetic datasets, and saves the results as .json.
+
+ Usage:
+  python -m benchmark.run [--sizes 640x512 1280x1024] [--n-frames 50] [--out results.json]
+  python -m benchmark.run --compare before.json after.json
+"""
+import argparse
+import copy
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+import cv2 as cv
+import numpy as np
+from benchmark import synthetic
+from code.utils import load_yaml_data
+from code.label import download_video_frames_and_rectify, Draw
+
+
+DISP_PXL = 40 # Disparity of the synthetic scene
+N_IDS = 3 # Number of labelled ids
+ANCHOR_STEP = 5 # An anchor is labelled every `ANCHOR_STEP` frames
+
+
+def get_stats_ms(times_s, name):
+    times_ms = 1000. * np.asarray(times_s)
+    return {"{}_mean_ms".format(name): float(np.mean(times_ms)),
+            "{}_p50_ms".format(name): float(np.percentile(times_ms, 50)),
+            "{}_p95_ms".format(name): float(np.percentile(times_ms, 95))}
+
+
+def time_call(f, *args):
+    t_start = time.perf_counter()
+    f(*args)
+    return time.perf_counter() - t_start
+
+
+def label_anchors(D):
+    """ A few ids, with a manual kpt pair every `ANCHOR_STEP` frames """
+    Keypoints = D.Keypoints
+    with Keypoints.transaction():
+        for ind_im in range(0, D.n_im, ANCHOR_STEP):
+            Keypoints.update_ktp_pairs(D.Images.get_im_pair_name(ind_im))
+            for ind_id in range(N_IDS):
+                u_l = D.im_w // 2 + 50 * ind_id + ind_im % 7
+                v = D.im_h // 2 + 30 * ind_id
+                Keypoints.new_kpt(True, ind_id, u_l, v)
+                Keypoints.new_kpt(False, ind_id, u_l - DISP_PXL, v)
+    Keypoints.flush(wait=True)
+
+
+def check_match(D):
+    """ The synthetic scene has to have a positive disparity, or the matching times are meaningless """
+    for ind_im in range(0, D.n_im, ANCHOR_STEP):
+        D.Images.im_update(ind_im)
+        im_l, im_r = D.Images.get_im_pair()
+        Keypoints = D.Keypoints
+        Keypoints.update_ktp_pairs(D.Images.get_im_pair_name(ind_im))
+        for ind_id in range(N_IDS):
+            kpt_l, kpt_r = Keypoints.get_kpts_given_ind_id(ind_id)
+            u_r = D.Matcher.suggest(im_l, im_r, kpt_l["u"], kpt_l["v"])
+            if u_r is None or abs(u_r - kpt_r["u"]) > 1:
+                print("Error: match suggested at u_r = {} instead of {} (frame {}, id {})".format(
+                      u_r, kpt_r["u"], ind_im, ind_id))
+                exit(1)
+
+
+def run_dataset(config, dir_data, im_w, im_h, n_frames):
+    results = {}
+    synthetic.make_dataset(dir_data, im_w, im_h, n_frames, disp_pxl=DISP_PXL)
+    config = copy.deepcopy(config)
+    config["data"]["dir"] = dir_data
+    # Extraction (including the rectification maps, not cached yet)
+    t_extract = time_call(download_video_frames_and_rectify, config)
+    results["extract_fps"] = n_frames / t_extract
+    v = download_video_frames_and_rectify(config)
+    D = Draw(config, v)
+    n_im = D.n_im
+    # Loading images, in order (as when pressing `d`) and in random order (as when jumping)
+    D.Images.Frames.clear()
+    times = [time_call(D.Images.im_update, ind_im) for ind_im in range(n_im)]
+    results.update(get_stats_ms(times, "im_update_seq"))
+    D.Images.Frames.clear()
+    rng = np.random.default_rng(0)
+    times = [time_call(D.Images.im_update, ind_im) for ind_im in rng.permutation(n_im)]
+    results.update(get_stats_ms(times, "im_update_rand"))
+    # Drawing
+    label_anchors(D)
+    check_match(D)
+    times = []
+    for ind_im in range(n_im):
+        D.ind_im = ind_im
+        D.Images.im_update(ind_im)
+        times.append(time_call(D.update_im_with_keypoints, True))
+    results.update(get_stats_ms(times, "update_im_with_keypoints"))
+    times = []
+    for i in range(100):
+        # A mouse move and the drawing shown after it
+        t_start = time.perf_counter()
+        D.mouse_move((37 * i) % (2 * D.im_w), (53 * i) % D.im_h)
+        D.get_draw()
+        times.append(time.perf_counter() - t_start)
+    results.update(get_stats_ms(times, "mouse_move_get_draw"))
+    # Interpolation and ground-truth, per frame
+    t_interp = sum(time_call(D.Interpolation.start, ind_id, 0) for ind_id in range(N_IDS))
+    results["interp_per_frame_ms"] = 1000. * t_interp / (N_IDS * n_im)
+    t_gt = sum(time_call(D.GT.start, ind_id) for ind_id in range(N_IDS))
+    results["gt_per_frame_ms"] = 1000. * t_gt / (N_IDS * n_im)
+    D.close()
+    return results
+
+
+def get_commit():
+    try:
+        out = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True)
+        return out.stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run(config, sizes, n_frames, path_out):
+    report = {"commit": get_commit(),
+              "python": platform.python_version(),
+              "opencv": cv.__version__,
+              "n_cpus": os.cpu_count(),
+              "datasets": {}}
+    dir_tmp = tempfile.mkdtemp(prefix="bench_")
+    try:
+        for im_w, im_h in sizes:
+            name = "{}x{}x{}".format(im_w, im_h, n_frames)
+            print("Benchmarking {}...".format(name))
+            dir_data = os.path.join(dir_tmp, name)
+            report["datasets"][name] = run_dataset(config, dir_data, im_w, im_h, n_frames)
+            shutil.rmtree(dir_data)
+    finally:
+        shutil.rmtree(dir_tmp, ignore_errors=True)
+    with open(path_out, "w") as f_tmp:
+        json.dump(report, f_tmp, indent=2, sort_keys=True)
+    print_report(report)
+    print("Results saved in {}".format(path_out))
+
+
+def print_report(report):
+    for name, results in report["datasets"].items():
+        print(name)
+        for metric, value in sorted(results.items()):
+            print("  {:<36} {:>10.3f}".format(metric, value))
+
+
+def compare(path_before, path_after, threshold):
+    """ Returns `True` if no metric got worse by more than `threshold` (e.g. 0.1 = 10%) """
+    with open(path_before) as f_tmp:
+        before = json.load(f_tmp)
+    with open(path_after) as f_tmp:
+        after = json.load(f_tmp)
+    print("{} -> {}".format(before["commit"], after["commit"]))
+    is_ok = True
+    for name, results in after["datasets"].items():
+        results_before = before["datasets"].get(name)
+        if results_before is None:
+            continue
+        print(name)
+        for metric, value in sorted(results.items()):
+            value_before = results_before.get(metric)
+            if value_before is None or value_before == 0 or value == 0:
+                continue
+            # Speedup > 1 is better, fps are higher-is-better and times lower-is-better
+            if metric.endswith("_fps"):
+                speedup = value / value_before
+            else:
+                speedup = value_before / value
+            flag = ""
+            if speedup < 1. - threshold:
+                flag = " SLOWER"
+                is_ok = False
+            print("  {:<36} {:>10.3f} {:>10.3f} {:>7.2f}x{}".format(metric, value_before, value, speedup, flag))
+    return is_ok
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark of the labelling tool')
+    parser.add_argument('--config', type=str, default='config.yaml')
+    parser.add_argument('--sizes', type=str, nargs='+', default=['640x512', '1280x1024'],
+                        help='Size of each stereo image, [width]x[height]')
+    parser.add_argument('--n-frames', type=int, default=50)
+    parser.add_argument('--out', type=str, default='bench_results.json')
+    parser.add_argument('--compare', type=str, nargs=2, metavar=('BEFORE', 'AFTER'), default=None)
+    parser.add_argument('--threshold', type=float, default=0.2,
+                        help='With --compare, exit code 1 if a metric is slower by more than this fraction')
+    args = parser.parse_args()
+    if args.compare is not None:
+        sys.exit(0 if compare(args.compare[0], args.compare[1], args.threshold) else 1)
+    config = load_yaml_data(args.config)
+    sizes = [synthetic.parse_size(size) for size in args.sizes]
+    run(config, sizes, args.n_frames, args.out)
+
+
+if __name__ == "__main__":
+    main()
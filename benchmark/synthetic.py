@@ -0,0 +1,84 @@
+"""
+ Synthetic stereo datasets: a textured plane, moving sideways, seen by a rectified stereo pair.
+
+ Usage: python -m benchmark.synthetic <dir> [--size 1280x1024] [--n-frames 100]
+"""
+import argparse
+import os
+
+import cv2 as cv
+import numpy as np
+
+
+def make_calibration(path, im_w, im_h, baseline_mm=4., focal_pxl=None):
+    """ `calibration.yaml` of an ideal stereo pair, in the same format as the real datasets """
+    if focal_pxl is None:
+        focal_pxl = 0.8 * im_w
+    m = np.array([[focal_pxl, 0., im_w / 2.],
+                  [0., focal_pxl, im_h / 2.],
+                  [0., 0., 1.]], dtype=np.float32)
+    fs = cv.FileStorage(path, cv.FILE_STORAGE_WRITE)
+    fs.write("R", np.eye(3, dtype=np.float32))
+    fs.write("T", np.array([[-baseline_mm, 0., 0.]], dtype=np.float32))
+    fs.write("M1", m)
+    fs.write("D1", np.zeros((1, 5), dtype=np.float32))
+    fs.write("M2", m)
+    fs.write("D2", np.zeros((1, 5), dtype=np.float32))
+    fs.release()
+
+
+def make_texture(h, w, rng):
+    """ Noise at multiple scales, so that there is texture for matching at any zoom level """
+    texture = np.zeros((h, w, 3), dtype=np.float32)
+    for scale in [1, 4, 16, 64]:
+        noise = rng.random((h // scale + 1, w // scale + 1, 3), dtype=np.float32)
+        texture += cv.resize(noise, (w, h), interpolation=cv.INTER_CUBIC)[:h, :w]
+    texture -= texture.min()
+    texture *= 255. / texture.max()
+    return texture.astype(np.uint8)
+
+
+def make_video(path, im_w, im_h, n_frames, disp_pxl=40, speed_pxl=2, vid_stack="horizontal", fps=25., seed=0):
+    rng = np.random.default_rng(seed)
+    margin = disp_pxl + speed_pxl * n_frames
+    texture = make_texture(im_h, im_w + margin, rng)
+    if vid_stack == "horizontal":
+        size = (2 * im_w, im_h)
+    else:
+        size = (im_w, 2 * im_h)
+    writer = cv.VideoWriter(path, cv.VideoWriter_fourcc(*"mp4v"), fps, size)
+    for ind_frame in range(n_frames):
+        u_0 = speed_pxl * ind_frame
+        im_l = texture[:, u_0:u_0 + im_w]
+        im_r = texture[:, u_0 + disp_pxl:u_0 + disp_pxl + im_w] # The right image sees each point `disp_pxl` to the left
+        axis = 1 if vid_stack == "horizontal" else 0
+        writer.write(np.ascontiguousarray(np.concatenate((im_l, im_r), axis=axis)))
+    writer.release()
+
+
+def make_dataset(dir_data, im_w, im_h, n_frames, disp_pxl=40, vid_stack="horizontal",
+                 file_calib="calibration.yaml", file_vid="video.mp4"):
+    if not os.path.isdir(dir_data):
+        os.makedirs(dir_data)
+    make_calibration(os.path.join(dir_data, file_calib), im_w, im_h)
+    make_video(os.path.join(dir_data, file_vid), im_w, im_h, n_frames, disp_pxl=disp_pxl, vid_stack=vid_stack)
+
+
+def parse_size(txt):
+    im_w, im_h = txt.split("x")
+    return int(im_w), int(im_h)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Generate a synthetic stereo video and its calibration')
+    parser.add_argument('dir', type=str)
+    parser.add_argument('--size', type=str, default='1280x1024', help='Size of each stereo image, [width]x[height]')
+    parser.add_argument('--n-frames', type=int, default=100)
+    parser.add_argument('--vid-stack', type=str, default='horizontal')
+    args = parser.parse_args()
+    im_w, im_h = parse_size(args.size)
+    make_dataset(args.dir, im_w, im_h, args.n_frames, vid_stack=args.vid_stack)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,142 @@
+import copy
+import glob
+import multiprocessing
+import os
+import time
+import traceback
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+import cv2 as cv
+from natsort import natsorted
+from code import utils
+from code.label import download_video_frames_and_rectify, export_gt
+try:
+    import resource # Not available on Windows
+except ImportError:
+    resource = None
+
+
+def get_datasets(config, config_paths=None, dir_pattern=None):
+    """
+     List of (name, config) to process, given:
+      - `config_paths`: a config file per dataset;
+      - `dir_pattern`: a glob of dataset dirs, each one used as `data.dir` in a copy of `config`.
+    """
+    datasets = []
+    for config_path in config_paths or []:
+        datasets.append((config_path, utils.load_yaml_data(config_path)))
+    if dir_pattern is not None:
+        for dir_data in natsorted(glob.glob(dir_pattern)):
+            if not os.path.isdir(dir_data):
+                continue
+            config_data = copy.deepcopy(config)
+            config_data["data"]["dir"] = dir_data
+            datasets.append((dir_data, config_data))
+    return datasets
+
+
+def init_worker(mem_limit_mb, n_cv_threads):
+    """ Run in each worker process, a dataset that needs more memory fails instead of the whole batch """
+    # Share the CPU cores between the processes, instead of each OpenCV using all of them
+    cv.setNumThreads(n_cv_threads)
+    if resource is None or mem_limit_mb is None:
+        return
+    n_bytes = mem_limit_mb * 1024 * 1024
+    resource.setrlimit(resource.RLIMIT_AS, (n_bytes, n_bytes))
+
+
+def get_result(name, config):
+    return {"name": name,
+            "dir": config["data"]["dir"],
+            "is_ok": False,
+            "error": None,
+            "t_extract_s": None,
+            "t_gt_s": None}
+
+
+def process_dataset(dataset):
+    """ Extract the frames and write the ground-truth of all ids, of a single dataset """
+    name, config = dataset
+    result = get_result(name, config)
+    t_start = time.perf_counter()
+    try:
+        v = download_video_frames_and_rectify(config)
+        t_extract = time.perf_counter()
+        result["t_extract_s"] = round(t_extract - t_start, 3)
+        export_gt(config, v=v)
+        result["t_gt_s"] = round(time.perf_counter() - t_extract, 3)
+        result["is_ok"] = True
+    except SystemExit:
+        # The "Error: ..." message was already printed
+        result["error"] = "exited with an error"
+    except BaseException as e:
+        traceback.print_exc()
+        result["error"] = "{}: {}".format(type(e).__name__, e)
+    result["t_total_s"] = round(time.perf_counter() - t_start, 3)
+    return result
+
+
+def run_in_process(dataset, mem_limit_mb, n_cv_threads):
+    """
+     `process_dataset()` in a new process, so that if the process dies (e.g. killed
+      when out of memory, or a crash in OpenCV) only this dataset fails
+    """
+    t_start = time.perf_counter()
+    # Spawned instead of forked, since the other batch threads (and OpenCV's) may hold locks when forking
+    with ProcessPoolExecutor(max_workers=1,
+                             mp_context=multiprocessing.get_context("spawn"),
+                             initializer=init_worker,
+                             initargs=(mem_limit_mb, n_cv_threads)) as executor:
+        try:
+            return executor.submit(process_dataset, dataset).result()
+        except BrokenProcessPool:
+            name, config = dataset
+            print("Error: the process of {} died".format(name))
+            result = get_result(name, config)
+            result["error"] = "the process died (killed, e.g. out of memory, or crashed)"
+            result["t_total_s"] = round(time.perf_counter() - t_start, 3)
+            return result
+
+
+def get_summary_txt(results, t_total):
+    lines = ["{:<40} {:>8} {:>10} {:>10}".format("Dataset", "Status", "Extract[s]", "GT[s]")]
+    for r in results:
+        lines.append("{:<40} {:>8} {:>10} {:>10}".format(
+                     r["name"][-40:],
+                     "ok" if r["is_ok"] else "FAILED",
+                     "-" if r["t_extract_s"] is None else "{:.1f}".format(r["t_extract_s"]),
+                     "-" if r["t_gt_s"] is None else "{:.1f}".format(r["t_gt_s"])))
+    for r in results:
+        if not r["is_ok"]:
+            lines.append("{}: {}".format(r["name"], r["error"]))
+    n_ok = sum(r["is_ok"] for r in results)
+    lines.append("{}/{} datasets processed in {:.1f} s".format(n_ok, len(results), t_total))
+    return "\n".join(lines)
+
+
+def run_batch(config, config_paths=None, dir_pattern=None):
+    """
+     Process many datasets in a pool of processes, returns `True` if all of them succeeded.
+
+     Each dataset is processed in its own process, with its memory limited to `batch.mem_limit_mb`,
+      so that the memory of one dataset is not kept for the next, and a process that dies only fails its dataset.
+    """
+    c_batch = config["batch"]
+    datasets = get_datasets(config, config_paths, dir_pattern)
+    if not datasets:
+        print("Error: no datasets found")
+        return False
+    n_workers = c_batch["n_workers"]
+    print("Processing {} datasets with {} processes".format(len(datasets), n_workers))
+    n_cv_threads = max(1, (os.cpu_count() or 1) // n_workers)
+    t_start = time.perf_counter()
+    # Each thread waits for the process of one dataset at a time
+    with ThreadPoolExecutor(max_workers=n_workers) as pool:
+        results = list(pool.map(lambda dataset: run_in_process(dataset, c_batch["mem_limit_mb"], n_cv_threads), datasets))
+    t_total = time.perf_counter() - t_start
+    print(get_summary_txt(results, t_total))
+    report = {"t_total_s": round(t_total, 3), "datasets": results}
+    utils.write_yaml_data(c_batch["file_report"], report)
+    print("Report saved in {}".format(c_batch["file_report"]))
+    return all(r["is_ok"] for r in results)
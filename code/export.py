@@ -0,0 +1,76 @@
+import os
+
+import numpy as np
+from numpy.lib.format import open_memmap
+
+
+# One row per image pair, the bboxs are `-1` if there is none (not visible or difficult)
+GT_DTYPE = np.dtype([("ind_im", np.int32),
+                     ("is_visible", np.bool_),
+                     ("is_difficult", np.bool_),
+                     ("bbox_l", np.int32, (4,)), # x, y, w, h
+                     ("bbox_r", np.int32, (4,))])
+
+
+class NpyWriter:
+    """
+     Ground-truth of one id as a `.npy` table (`GT_DTYPE`), written row by row while the
+      frames are processed. The file is memory-mapped, so the whole table is never kept in memory.
+    """
+    def __init__(self, path, n_im):
+        self.path = path
+        self.path_tmp = "{}.tmp".format(path) # Renamed when complete, not to leave a partial table
+        self.table = open_memmap(self.path_tmp, mode="w+", dtype=GT_DTYPE, shape=(n_im,))
+        self.table["ind_im"] = np.arange(n_im)
+        self.table["bbox_l"] = -1
+        self.table["bbox_r"] = -1
+
+
+    def write(self, ind_im, is_visible, is_difficult, bboxs):
+        row = self.table[ind_im]
+        row["is_visible"] = is_visible
+        row["is_difficult"] = is_difficult
+        if bboxs is not None:
+            row["bbox_l"] = bboxs[0]
+            row["bbox_r"] = bboxs[1]
+
+
+    def close(self):
+        self.table.flush()
+        del self.table
+        os.replace(self.path_tmp, self.path)
+
+
+class MotWriter:
+    """
+     Ground-truth of all ids in the MOTChallenge text format, one file per stereo image:
+        <frame>,<id>,<bb_left>,<bb_top>,<bb_width>,<bb_height>,<conf>,<x>,<y>,<z>
+     The frames are 1-based, and only the bboxs are written (i.e. not the difficult keypoints).
+     The rows have to be written in frame order.
+    """
+    def __init__(self, path_l, path_r):
+        self.paths = [path_l, path_r]
+        self.f_l = open("{}.tmp".format(path_l), "w")
+        self.f_r = open("{}.tmp".format(path_r), "w")
+
+
+    def write(self, ind_im, ind_id, bboxs):
+        for f_tmp, (x, y, w, h) in zip([self.f_l, self.f_r], bboxs):
+            f_tmp.write("{},{},{},{},{},{},1,-1,-1,-1\n".format(ind_im + 1, ind_id, x, y, w, h))
+
+
+    def close(self):
+        self.f_l.close()
+        self.f_r.close()
+        for path in self.paths:
+            os.replace("{}.tmp".format(path), path)
+
+
+def load_gt_npy(path):
+    """ Ground-truth table written by `NpyWriter`, memory-mapped (e.g. `table["bbox_l"][ind_im]`) """
+    return np.load(path, mmap_mode="r")
+
+
+def load_gt_mot(path):
+    """ (N, 10) array of the rows of a file written by `MotWriter` """
+    return np.loadtxt(path, delimiter=",", ndmin=2)
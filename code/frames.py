@@ -0,0 +1,411 @@
+import os
+import threading
+import time
+
+from concurrent.futures import ThreadPoolExecutor
+import cv2 as cv
+import numpy as np
+from code import manifest, utils
+
+
+RAW_FILE = "frames.raw"
+RAW_HEADER = "frames.yaml"
+
+
+def get_im_name(ind_im):
+    return "{:04}".format(ind_im) # TODO: hardcoded 4 padded zeros
+
+
+def get_ind_im(im_name, n_im):
+    """ Inverse of `get_im_name()`, `None` if `im_name` is not one of the `n_im` names """
+    if not im_name.isdigit():
+        return None
+    ind_im = int(im_name)
+    if ind_im >= n_im or get_im_name(ind_im) != im_name:
+        return None
+    return ind_im
+
+
+def has_frames(frame_store, dir_l, dir_r, im_format):
+    """ If the frames were already extracted into `frame_store` ("png" or "raw"), in `dir_l` and `dir_r` """
+    for dir_side in [dir_l, dir_r]:
+        if not os.path.isdir(dir_side):
+            return False
+        if frame_store == "raw":
+            if not os.path.isfile(os.path.join(dir_side, RAW_HEADER)):
+                return False
+        elif not any(entry.name.endswith(im_format) for entry in os.scandir(dir_side)):
+            return False
+    return True
+
+
+def get_resolution(frame_store, dir_l, dir_r, im_format, path_manifest):
+    """ (im_h, im_w) of the frames extracted into `frame_store`, without opening the video """
+    if frame_store == "raw":
+        header = utils.load_yaml_data(os.path.join(dir_l, RAW_HEADER))
+        return header["im_h"], header["im_w"]
+    return manifest.open_manifest(path_manifest, dir_l, dir_r, im_format).get_resolution()
+
+
+class PngFrames:
+    """ One image file per frame (e.g. `left/0000.png` and `right/0000.png`), listed in a `FrameManifest` """
+    def __init__(self, dir_l, dir_r, im_format, path_manifest):
+        self.Manifest = manifest.open_manifest(path_manifest, dir_l, dir_r, im_format)
+        self.im_path_l = []
+        self.im_path_r = []
+        for ind_im in range(self.Manifest.get_n_im()):
+            im_path_l, im_path_r = self.Manifest.get_paths(ind_im)
+            self.im_path_l.append(im_path_l)
+            self.im_path_r.append(im_path_r)
+        self.n_im = self.Manifest.get_n_im()
+
+
+    def get_n_im(self):
+        return self.n_im
+
+
+    def get_im_name(self, ind_im):
+        return self.Manifest.get_im_name(ind_im)
+
+
+    def get_ind_im(self, im_name):
+        return self.Manifest.get_ind_im(im_name)
+
+
+    def get_resolution(self):
+        return self.Manifest.get_resolution()
+
+
+    def read_im(self, ind_im, is_left):
+        if is_left:
+            return cv.imread(self.im_path_l[ind_im], -1)
+        return cv.imread(self.im_path_r[ind_im], -1)
+
+
+class RawFrames:
+    """
+     One fixed-stride raw file per side (`frames.raw`), plus a small header (`frames.yaml`).
+
+     The files are opened with `np.memmap`, so `read_im()` returns a zero-copy view.
+    """
+    def __init__(self, dir_l, dir_r):
+        self.mm_l, self.n_im = self.open_raw(dir_l)
+        self.mm_r, n_im_r = self.open_raw(dir_r)
+        assert(self.n_im == n_im_r)
+
+
+    def open_raw(self, dir_side):
+        header = utils.load_yaml_data(os.path.join(dir_side, RAW_HEADER))
+        n_im = header["n_im"]
+        shape = (n_im, header["im_h"], header["im_w"], header["n_ch"])
+        if n_im == 0:
+            return np.zeros(shape, dtype=header["dtype"]), n_im
+        mm = np.memmap(os.path.join(dir_side, RAW_FILE),
+                       dtype=header["dtype"],
+                       mode="r",
+                       shape=shape)
+        return mm, n_im
+
+
+    def get_n_im(self):
+        return self.n_im
+
+
+    def get_im_name(self, ind_im):
+        return get_im_name(ind_im)
+
+
+    def get_ind_im(self, im_name):
+        return get_ind_im(im_name, self.n_im)
+
+
+    def get_resolution(self):
+        return self.mm_l.shape[1], self.mm_l.shape[2]
+
+
+    def read_im(self, ind_im, is_left):
+        if is_left:
+            return self.mm_l[ind_im]
+        return self.mm_r[ind_im]
+
+
+class RawFramesWriter:
+    """ Writes the frames of one side into a `RawFrames` store, in any order """
+    def __init__(self, dir_side):
+        self.dir_side = dir_side
+        self.f = open(os.path.join(dir_side, RAW_FILE), "wb")
+        self.lock = threading.Lock()
+        self.header = None
+
+
+    def write(self, ind_im, im):
+        im = np.ascontiguousarray(im)
+        with self.lock:
+            if self.header is None:
+                self.header = {"im_h": im.shape[0],
+                               "im_w": im.shape[1],
+                               "n_ch": im.shape[2] if im.ndim == 3 else 1,
+                               "dtype": im.dtype.name}
+            self.f.seek(ind_im * im.nbytes)
+            self.f.write(im.data)
+
+
+    def close(self, n_im):
+        self.f.close()
+        header = self.header
+        if header is None:
+            header = {"im_h": 0, "im_w": 0, "n_ch": 0, "dtype": "uint8"}
+        header["n_im"] = n_im
+        utils.write_yaml_data(os.path.join(self.dir_side, RAW_HEADER), header)
+
+
+class VideoFrames:
+    """
+     Reads the frames on-demand from the video, without extracting them first.
+
+     The frame count is checked once, when opening the video. Then, consecutive
+      frames are decoded without seeking, and the other frames are reached by
+      seeking (the video backend jumps to the previous keyframe and decodes forward).
+     The most recent frame pairs are rectified once and kept in a cache.
+    """
+    def __init__(self, v, vid_path, cache_size):
+        self.video = v
+        self.cap = cv.VideoCapture(vid_path)
+        self.lock = threading.Lock()
+        self.cache = utils.LRUCache(cache_size)
+        self.ind_next = 0 # Index of the frame that `cap.read()` returns
+        self.n_im = self.build_seek_index()
+
+
+    def build_seek_index(self):
+        n_im = int(self.cap.get(cv.CAP_PROP_FRAME_COUNT))
+        # The container's frame count may be off, check that the last frame can be decoded
+        while n_im > 0:
+            self.cap.set(cv.CAP_PROP_POS_FRAMES, n_im - 1)
+            if self.cap.grab():
+                break
+            n_im -= 1
+        self.cap.set(cv.CAP_PROP_POS_FRAMES, 0)
+        return n_im
+
+
+    def get_n_im(self):
+        return self.n_im
+
+
+    def get_im_name(self, ind_im):
+        return get_im_name(ind_im)
+
+
+    def get_ind_im(self, im_name):
+        return get_ind_im(im_name, self.n_im)
+
+
+    def get_resolution(self):
+        return self.video.im_h, self.video.im_w
+
+
+    def read_pair(self, ind_im):
+        with self.lock:
+            im_pair = self.cache.get(ind_im)
+            if im_pair is not None:
+                return im_pair
+            if ind_im != self.ind_next:
+                self.cap.set(cv.CAP_PROP_POS_FRAMES, ind_im)
+            ret, frame = self.cap.read()
+            if not ret:
+                print("Error: failed to decode frame {}".format(ind_im))
+                exit(1)
+            self.ind_next = ind_im + 1
+            im_pair = self.video.split_frame(frame)
+            self.cache.put(ind_im, im_pair)
+            return im_pair
+
+
+    def read_im(self, ind_im, is_left):
+        im_l, im_r = self.read_pair(ind_im)
+        if is_left:
+            return im_l
+        return im_r
+
+
+class FrameCache:
+    """
+     Wraps a frame source (e.g. `PngFrames`) with a prefetching LRU cache.
+
+     The `n_prefetch` next and previous image pairs are loaded by a pool of
+      background threads, and the left and right images are loaded at the same time.
+     If a display size is set, the threads also build the downscaled images shown
+      in the interface, which are cached next to the original ones.
+    """
+    def __init__(self, Frames, n_prefetch, n_workers, mem_budget_mb):
+        self.Frames = Frames
+        self.n_im = Frames.get_n_im()
+        self.n_prefetch = n_prefetch
+        self.pool = ThreadPoolExecutor(max_workers=n_workers)
+        self.cache = utils.LRUCache(max_bytes=mem_budget_mb * 1024 * 1024)
+        self.pending = {}
+        self.lock = threading.Lock()
+        self.display_size = None # (width, height) of the downscaled images, `None` if not needed
+        # Statistics
+        self.n_hits = 0
+        self.n_misses = 0
+        self.t_wait = 0.
+
+
+    def load_im(self, key):
+        ind_im, is_left = key
+        im = self.Frames.read_im(ind_im, is_left)
+        if isinstance(im, np.memmap):
+            im = np.array(im) # Read it from disk now, instead of on the UI thread
+        self.cache.put(key, im)
+        if self.display_size is not None:
+            self.resize_display_im(key, im)
+        with self.lock:
+            self.pending.pop(key, None)
+        return im
+
+
+    def request_im(self, key):
+        """ Start loading an image in the background, if not already loaded or loading """
+        with self.lock:
+            future = self.pending.get(key)
+            if future is None and key not in self.cache:
+                future = self.pool.submit(self.load_im, key)
+                self.pending[key] = future
+            return future
+
+
+    def get_im_pair(self, ind_im):
+        keys = [(ind_im, True), (ind_im, False)]
+        ims = [self.cache.get(key) for key in keys]
+        if ims[0] is not None and ims[1] is not None:
+            self.n_hits += 1
+        else:
+            self.n_misses += 1
+            t_start = time.perf_counter()
+            # Do not wait behind the prefetches of the previous image pair
+            self.cancel_pending()
+            # The right image is loaded in the background, while the left one is loaded here
+            future_r = self.request_im(keys[1]) if ims[1] is None else None
+            if ims[0] is None:
+                ims[0] = self.get_or_load_im(keys[0])
+            if ims[1] is None:
+                ims[1] = future_r.result() if future_r is not None else self.get_or_load_im(keys[1])
+            self.t_wait += time.perf_counter() - t_start
+        self.prefetch(ind_im)
+        return ims[0], ims[1]
+
+
+    def get_or_load_im(self, key):
+        """ Waits for the image if it is already being loaded, or loads it on this thread """
+        with self.lock:
+            future = self.pending.get(key)
+        if future is not None:
+            return future.result()
+        im = self.cache.get(key)
+        if im is None:
+            im = self.load_im(key)
+        return im
+
+
+    def read_im(self, ind_im, is_left):
+        """
+         An image for processing other than the interface (e.g. propagation): from the cache if
+          it is there, otherwise read without caching it, prefetching or counting it in the stats
+        """
+        im = self.cache.get((ind_im, is_left))
+        if im is None:
+            im = self.Frames.read_im(ind_im, is_left)
+            if isinstance(im, np.memmap):
+                im = np.array(im)
+        return im
+
+
+    def cancel_pending(self):
+        """ Cancel the loads that have not started yet """
+        with self.lock:
+            for key, future in list(self.pending.items()):
+                if future.cancel():
+                    del self.pending[key]
+
+
+    def set_display_size(self, disp_w, disp_h):
+        self.display_size = (disp_w, disp_h)
+
+
+    def resize_display_im(self, key, im):
+        im_disp = cv.resize(im, self.display_size, interpolation=cv.INTER_AREA)
+        self.cache.put(key + ("display",), im_disp)
+        return im_disp
+
+
+    def get_display_im(self, key, im):
+        """ `im` (the image of `key`) downscaled to the display size, if set """
+        if self.display_size is None:
+            return im
+        im_disp = self.cache.get(key + ("display",))
+        if im_disp is None:
+            # Not built in the background, e.g. it was loaded before the display size was set
+            im_disp = self.resize_display_im(key, im)
+        return im_disp
+
+
+    def prefetch(self, ind_im):
+        for offset in range(1, self.n_prefetch + 1):
+            for ind in (ind_im + offset, ind_im - offset):
+                ind %= self.n_im # The interface wraps around the first and last images
+                self.request_im((ind, True))
+                self.request_im((ind, False))
+
+
+    def get_stats_txt(self):
+        n_total = max(self.n_hits + self.n_misses, 1)
+        return "Frame cache: {:.1f}% hits ({}/{}), {:.3f} s waiting for frames, {:.1f} MB used".format(
+               100. * self.n_hits / n_total,
+               self.n_hits,
+               self.n_hits + self.n_misses,
+               self.t_wait,
+               self.cache.n_bytes / (1024 * 1024))
+
+
+    def clear(self):
+        """ Drop all the loaded images, e.g. to time loading them again """
+        with self.lock:
+            futures = list(self.pending.values())
+        for future in futures:
+            future.result()
+        self.cache.clear()
+
+
+    def close(self):
+        self.cancel_pending()
+        self.pool.shutdown(wait=False)
+
+
+class PyramidCache:
+    """
+     Grayscale image pyramids for optical flow, built once per image.
+
+     When propagating keypoints, each image is used by both the forward and the
+      backward tracking, so its pyramid is kept instead of being built twice.
+    """
+    def __init__(self, Frames, max_level, mem_budget_mb):
+        self.Frames = Frames # A `FrameCache`
+        self.max_level = max_level
+        self.cache = utils.LRUCache(max_bytes=mem_budget_mb * 1024 * 1024)
+
+
+    def get_pyramid(self, ind_im, is_left):
+        """ List of `max_level + 1` images, from the original resolution to the coarsest """
+        key = (ind_im, is_left)
+        pyr = self.cache.get(key)
+        if pyr is None:
+            im = self.Frames.read_im(ind_im, is_left)
+            if im.ndim == 3:
+                im = cv.cvtColor(im, cv.COLOR_BGR2GRAY)
+            pyr = [im]
+            for _ in range(self.max_level):
+                pyr.append(cv.pyrDown(pyr[-1]))
+            self.cache.put(key, pyr)
+        return pyr
@@ -0,0 +1,101 @@
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+
+TRACK_DTYPE = np.dtype([("has_kpt", bool), # Labelled in both images
+                        ("has_uv", bool), # With a position, and not just marked as not visible or difficult
+                        ("is_visible", bool),
+                        ("is_difficult", bool),
+                        ("is_interp", bool),
+                        ("u_l", np.int64),
+                        ("v_l", np.int64),
+                        ("u_r", np.int64),
+                        ("v_r", np.int64)])
+
+
+class KptIndex:
+    """
+     All the keypoints of the sequence in memory, as one array per id (a track),
+      indexed by the image pair. It avoids reloading each image's keypoints from
+      the store, when going through the whole sequence.
+
+     The keypoints are loaded once, in parallel, and then the index is updated by
+      `Keypoints` every time that an image pair is saved.
+    """
+    def __init__(self, store, im_names, n_workers=8):
+        self.im_names = im_names
+        self.n_im = len(im_names)
+        self.im_name_to_ind = {im_name: ind_im for ind_im, im_name in enumerate(im_names)}
+        self.tracks = {}
+        self.load(store, n_workers)
+
+
+    def load(self, store, n_workers):
+        im_names = [im_name for im_name in store.get_im_names() if im_name in self.im_name_to_ind]
+        with ThreadPoolExecutor(max_workers=n_workers) as pool:
+            for im_name, (kpts_l, kpts_r) in zip(im_names, pool.map(store.load, im_names)):
+                self.update(im_name, kpts_l, kpts_r)
+
+
+    def get_track(self, ind_id, create=False):
+        track = self.tracks.get(ind_id)
+        if track is None and create:
+            track = np.zeros(self.n_im, dtype=TRACK_DTYPE)
+            self.tracks[ind_id] = track
+        return track
+
+
+    def get_ids(self):
+        return sorted(self.tracks.keys())
+
+
+    def update(self, im_name, kpts_l, kpts_r):
+        ind_im = self.im_name_to_ind.get(im_name)
+        if ind_im is None:
+            return
+        for track in self.tracks.values():
+            track["has_kpt"][ind_im] = False
+        for ind_id, k_l in kpts_l.items():
+            k_r = kpts_r.get(ind_id)
+            if k_r is None:
+                continue
+            track = self.get_track(ind_id, create=True)
+            has_uv = "u" in k_l and "u" in k_r
+            track[ind_im] = (True,
+                             has_uv,
+                             k_l["is_visible_in_both_stereo"] and k_r["is_visible_in_both_stereo"],
+                             k_l.get("is_difficult", False) or k_r.get("is_difficult", False),
+                             k_l.get("is_interp", False) or k_r.get("is_interp", False),
+                             k_l["u"] if has_uv else 0,
+                             k_l["v"] if has_uv else 0,
+                             k_r["u"] if has_uv else 0,
+                             k_r["v"] if has_uv else 0)
+
+
+    def get_kpt_pair(self, ind_im, ind_id):
+        """ Same as `Keypoints.get_kpts_given_ind_id()`, but for any image pair """
+        track = self.tracks.get(ind_id)
+        if track is None or not track[ind_im]["has_kpt"]:
+            return None, None
+        t = track[ind_im]
+        k_l = {"is_visible_in_both_stereo": bool(t["is_visible"]),
+               "is_difficult": bool(t["is_difficult"])}
+        k_r = dict(k_l)
+        if t["has_uv"]:
+            k_l.update({"u": int(t["u_l"]), "v": int(t["v_l"]), "is_interp": bool(t["is_interp"])})
+            k_r.update({"u": int(t["u_r"]), "v": int(t["v_r"]), "is_interp": bool(t["is_interp"])})
+        return k_l, k_r
+
+
+    def get_invalid_kpts(self):
+        """ (ind_im, ind_id, reason) of the kpt pairs that do not fit rectified stereo images """
+        invalid = []
+        for ind_id in self.get_ids():
+            track = self.tracks[ind_id]
+            has_uv = track["has_kpt"] & track["has_uv"]
+            for ind_im in np.flatnonzero(has_uv & (track["u_l"] - track["u_r"] <= 0)):
+                invalid.append((int(ind_im), ind_id, "disparity should be positive"))
+            for ind_im in np.flatnonzero(has_uv & (track["v_l"] != track["v_r"])):
+                invalid.append((int(ind_im), ind_id, "left and right keypoints are not on the same row"))
+        return sorted(invalid)
@@ -1,26 +1,35 @@
-import glob
 import os
 import math
+import queue
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
 
-from natsort import natsorted
 import cv2 as cv
 import numpy as np
-from pathlib import Path
+from code import frames
+from code import export
+from code import index
+from code import manifest
+from code import match
+from code import rectify
+from code import store
+from code import trace
 from code import utils
-from scipy.interpolate import interp1d
 
 
 class Keypoints:
-    def __init__(self, dir_out_l, dir_out_r):
+    def __init__(self, store, im_names):
         self.kpts_l = {}
         self.kpts_r = {}
-        self.dir_out_l = dir_out_l
-        self.dir_out_r = dir_out_r
-        self.create_output_paths()
-        self.path_l = None
-        self.path_r = None
+        self.store = store
+        self.Index = index.KptIndex(store, im_names)
+        self.im_name = None
         self.new_l = None
         self.new_r = None
+        self.session_loaded = None # While in `edit_session()`, {im_name: (kpts_l, kpts_r)}
+        self.session_edited = None
 
 
     def add_kpt_pair(self, ind_id, kpt_l, kpt_r):
@@ -44,20 +53,34 @@ class Keypoints:
         self.check_for_new_kpt_pair()
 
 
+    def get_intrp_kpt(self, u, v):
+        return {"u": u,
+                "v": v,
+                "is_interp": True,
+                "is_visible_in_both_stereo": True,
+                "is_difficult": False}
+
+
     def new_intrp_pair(self, ind_id, u_l, v_l, u_r, v_r):
-        k_l = {"u": u_l,
-               "v": v_l,
-               "is_interp": True,
-               "is_visible_in_both_stereo": True,
-               "is_difficult": False}
-        k_r = {"u": u_r,
-               "v": v_r,
-               "is_interp": True,
-               "is_visible_in_both_stereo": True,
-               "is_difficult": False}
+        k_l = self.get_intrp_kpt(u_l, v_l)
+        k_r = self.get_intrp_kpt(u_r, v_r)
         self.add_kpt_pair(ind_id, k_l, k_r)
 
 
+    def add_intrp_pairs(self, intrp_pairs):
+        """
+         Save many interpolated kpt pairs in a single transaction, writing each image pair once.
+         `intrp_pairs` is a dict {im_name: [(ind_id, u_l, v_l, u_r, v_r), ...]}
+        """
+        with self.transaction():
+            for im_name, pairs in intrp_pairs.items():
+                self.update_ktp_pairs(im_name)
+                for ind_id, u_l, v_l, u_r, v_r in pairs:
+                    self.kpts_l[ind_id] = self.get_intrp_kpt(u_l, v_l)
+                    self.kpts_r[ind_id] = self.get_intrp_kpt(u_r, v_r)
+                self.save_kpt_pairs_to_files()
+
+
     def get_new_kpt_l(self):
         return self.new_l
 
@@ -74,7 +97,7 @@ class Keypoints:
             return True
         else:
             print("Error: disparity should be positive!")
-            exit()
+            exit(1)
 
 
     def check_for_new_kpt_pair(self):
@@ -86,13 +109,6 @@ class Keypoints:
             self.new_r = None
 
 
-    def create_output_paths(self):
-        if not os.path.isdir(self.dir_out_l):
-            os.mkdir(self.dir_out_l)
-        if not os.path.isdir(self.dir_out_r):
-            os.mkdir(self.dir_out_r)
-
-
     def eliminate_unpaired_kpts(self):
         keys_l = self.kpts_l.keys()
         keys_r = self.kpts_r.keys()
@@ -104,10 +120,58 @@ class Keypoints:
             self.new_r = None
 
 
+    @trace.timed("Keypoints.save_kpt_pairs_to_files")
     def save_kpt_pairs_to_files(self):
         self.eliminate_unpaired_kpts()
-        utils.write_yaml_data(self.path_l, self.kpts_l)
-        utils.write_yaml_data(self.path_r, self.kpts_r)
+        if self.session_edited is not None:
+            # Saved when the edit session ends
+            self.session_edited[self.im_name] = (self.kpts_l, self.kpts_r)
+            return
+        self.store.save(self.im_name, self.kpts_l, self.kpts_r)
+        self.Index.update(self.im_name, self.kpts_l, self.kpts_r)
+
+
+    def transaction(self):
+        """ Group the updates of multiple image pairs into a single update """
+        return self.store.transaction()
+
+
+    @contextmanager
+    def edit_session(self, im_names, n_workers=8):
+        """
+         Edit a range of image pairs as a single operation, e.g.:
+            with Keypoints.edit_session(im_names):
+                for im_name in im_names:
+                    Keypoints.update_ktp_pairs(im_name)
+                    Keypoints.eliminate_kpts(ind_id)
+         The `im_names` image pairs are loaded in parallel when the session starts, and the edits
+          are only kept in memory. When the session ends, all the edited image pairs are saved
+          together (in parallel files, or a single database transaction). If an exception is
+          raised inside the session, none of its edits are saved.
+        """
+        with ThreadPoolExecutor(max_workers=n_workers) as pool:
+            self.session_loaded = dict(zip(im_names, pool.map(self.store.load, im_names)))
+        self.session_edited = {}
+        try:
+            yield self
+            edited = self.session_edited
+        finally:
+            self.session_loaded = None
+            self.session_edited = None
+        self.store.save_many(edited, n_workers)
+        for im_name, (kpts_l, kpts_r) in edited.items():
+            self.Index.update(im_name, kpts_l, kpts_r)
+
+
+    def flush(self, wait=False):
+        if wait:
+            self.store.flush()
+        else:
+            self.store.request_flush()
+
+
+    def close(self):
+        self.store.close()
 
 
     def eliminate_kpts(self, ind_id):
@@ -128,23 +192,14 @@ class Keypoints:
         return self.kpts_l.get(ind_id), self.kpts_r.get(ind_id)
 
 
-    def load_kpts_from_file(self, path):
-        if os.path.isfile(path):
-            # Load data from .yaml file
-            data = utils.load_yaml_data(path)
-            if data is not None:
-                return data
-        return {}
-
-
     def update_ktp_pairs(self, im_name):
-        self.kpts_l = {}
-        self.kpts_r = {}
-        name_file = "{}.yaml".format(im_name)
-        self.path_l = os.path.join(self.dir_out_l, name_file)
-        self.path_r = os.path.join(self.dir_out_r, name_file)
-        self.kpts_l = self.load_kpts_from_file(self.path_l)
-        self.kpts_r = self.load_kpts_from_file(self.path_r)
+        self.im_name = im_name
+        if self.session_edited is not None and im_name in self.session_edited:
+            self.kpts_l, self.kpts_r = self.session_edited[im_name]
+        elif self.session_loaded is not None and im_name in self.session_loaded:
+            self.kpts_l, self.kpts_r = self.session_loaded[im_name]
+        else:
+            self.kpts_l, self.kpts_r = self.store.load(im_name)
         assert(len(self.kpts_l) == len(self.kpts_r))
 
 
@@ -221,16 +276,17 @@ class Keypoints:
 
 
 class Images:
-    def __init__(self, dir_l, dir_r, im_format):
-        path_l = os.path.join(dir_l, "*{}".format(im_format))
-        path_r = os.path.join(dir_r, "*{}".format(im_format))
-        self.im_path_l = natsorted(glob.glob(path_l))
-        self.im_path_r = natsorted(glob.glob(path_r))
-        assert(len(self.im_path_l) == len(self.im_path_r))
+    def __init__(self, dir_l, dir_r, im_format, frame_store, v, n_prefetch, n_workers, mem_budget_mb, path_manifest):
+        if frame_store == "raw":
+            Frames = frames.RawFrames(dir_l, dir_r)
+        elif frame_store == "video":
+            Frames = frames.VideoFrames(v, v.vid_path, v.vid_cache_size)
+        else:
+            Frames = frames.PngFrames(dir_l, dir_r, im_format, path_manifest)
+        self.Frames = frames.FrameCache(Frames, n_prefetch, n_workers, mem_budget_mb)
         # Initialization
-        self.im_h = -1
-        self.im_w = -1
-        self.n_im = len(self.im_path_l)
+        self.im_h, self.im_w = Frames.get_resolution()
+        self.n_im = Frames.get_n_im()
 
 
     def get_n_im(self):
@@ -238,6 +294,9 @@ class Images:
 
 
     def get_resolution(self):
+        if self.im_h == -1 or self.im_w == -1:
+            # Not known by the frame store, until the first image pair is loaded
+            self.im_update(0)
         return self.im_h, self.im_w
 
 
@@ -245,18 +304,41 @@ class Images:
         return self.im_l, self.im_r
 
 
+    def get_display_pair(self):
+        """ The current image pair, downscaled to be shown if `set_display_size()` was called """
+        return self.im_l_disp, self.im_r_disp
+
+
+    def set_display_size(self, disp_w, disp_h):
+        self.Frames.set_display_size(disp_w, disp_h)
+
+
     def get_im_pair_name(self, ind_im):
-        im_name_l = Path(self.im_path_l[ind_im]).stem
-        im_name_r = Path(self.im_path_r[ind_im]).stem
-        assert(im_name_l == im_name_r)
-        return im_name_l
+        return self.Frames.Frames.get_im_name(ind_im)
 
 
+    def get_ind_im(self, im_name):
+        """ Index of the image pair `im_name`, or `None` if there is no such image pair """
+        return self.Frames.Frames.get_ind_im(im_name)
+
+
+    def verify_frames(self):
+        """ Names of the image pairs whose files changed since they were extracted """
+        if not isinstance(self.Frames.Frames, frames.PngFrames):
+            return []
+        return self.Frames.Frames.Manifest.verify()
+
+
+    def close(self):
+        print(self.Frames.get_stats_txt())
+        self.Frames.close()
+
+
+    @trace.timed("Images.im_update")
     def im_update(self, ind_im):
-        im_path_l = self.im_path_l[ind_im]
-        im_path_r = self.im_path_r[ind_im]
-        self.im_l = cv.imread(im_path_l, -1)
-        self.im_r = cv.imread(im_path_r, -1)
+        self.im_l, self.im_r = self.Frames.get_im_pair(ind_im)
+        self.im_l_disp = self.Frames.get_display_im((ind_im, True), self.im_l)
+        self.im_r_disp = self.Frames.get_display_im((ind_im, False), self.im_r)
         if (self.im_h != -1 and self.im_w != -1):
             # Check that images have the same size
             assert(self.im_l.shape[0] == self.im_r.shape[0] == self.im_h)
@@ -271,118 +353,230 @@ class Interpolation:
         self.Keypoints = Keypoints
 
 
-    def get_interp_values(self, im_an, an_loc, i_min, i_max, i_n):
-        inds_im = np.linspace(i_min, i_max, num=i_n, endpoint=True)
+    def get_interp_values(self, im_an, an_loc, inds_im):
+        """ Interpolate the anchors' locations `an_loc` (N, n_coords) at the images `inds_im` """
+        from scipy.interpolate import interp1d # Imported here, since it takes long and is rarely needed
         if len(im_an) > 3:
-            f = interp1d(im_an, an_loc, kind='cubic')
+            f = interp1d(im_an, an_loc, kind='cubic', axis=0)
         else:
-            f = interp1d(im_an, an_loc, kind='linear')
+            f = interp1d(im_an, an_loc, kind='linear', axis=0)
         interp_values = f(inds_im)
         return np.rint(interp_values)
 
 
-    def get_kpt_anc_in_range(self, rng, ind_id, data_kpt_intrp):
-        """ Get anchors for interpolation """
-        for i in rng:
-            im_name = self.Images.get_im_pair_name(i)
-            self.Keypoints.update_ktp_pairs(im_name)
-            k_l, k_r = self.Keypoints.get_kpts_given_ind_id(ind_id)
-            if k_l is None or k_r is None:
-                data_kpt_intrp[im_name] = None
-                continue
-            if not k_l["is_visible_in_both_stereo"] or \
-               not k_r["is_visible_in_both_stereo"]:
-                break
-            if k_l["is_difficult"] or \
-               k_r["is_difficult"]:
-                break
-            data_kpt_intrp[im_name] = None
-            if not k_l["is_interp"] and not k_r["is_interp"]:
-                data_kpt_intrp[im_name] = {"k_l": k_l, "k_r": k_r}
-        return data_kpt_intrp
+    def get_breaks(self, track):
+        """ Images where the kpt is not visible or difficult, which stop the interpolation """
+        return track["has_kpt"] & (~track["is_visible"] | track["is_difficult"])
+
 
+    def get_segment(self, track, ind_im):
+        """ First and last images connected to `ind_im`, without a break in between """
+        inds_break = np.flatnonzero(self.get_breaks(track))
+        i = np.searchsorted(inds_break, ind_im, side='right')
+        i_first = inds_break[i - 1] + 1 if i > 0 else 0
+        i_last = inds_break[i] - 1 if i < len(inds_break) else len(track) - 1
+        return i_first, i_last
 
-    def get_kpt_data_given_id_and_im(self, ind_id, ind_im):
-        """ 1. Go through all picture-pairs and get all kpts
-                with `ind_id` = self.ind_id.
 
-                Get only the ones that were manually labelled,
-                since those are the accurate positions that are used
-                for interpolation.
+    def get_segments(self, track):
+        """ All the ranges of images without a break in between """
+        inds_break = np.flatnonzero(self.get_breaks(track))
+        bounds = np.concatenate(([-1], inds_break, [len(track)]))
+        return [(a + 1, b - 1) for a, b in zip(bounds[:-1], bounds[1:]) if b - a > 1]
 
-                Get only visible kpts that are connected to ind_im.
+
+    def interp_segment(self, track, ind_id, i_first, i_last, intrp_pairs):
         """
-        data_kpt_intrp = {}
-        # Get data before `ind_im`
-        rng = range(ind_im, -1, -1) # From `ind_im` to 0, since exclusive
-        data_kpt_intrp = self.get_kpt_anc_in_range(rng, ind_id, data_kpt_intrp)
-        # Get data after `ind_im`
-        rng = range(ind_im + 1, self.Images.n_im, 1)
-        data_kpt_intrp = self.get_kpt_anc_in_range(rng, ind_id, data_kpt_intrp)
-        # Count non-Nones
-        n_non_nones = sum(x is not None for x in data_kpt_intrp.values())
-        if n_non_nones < 2: # Need at least 2 points to interpolate
-            return None
-        return data_kpt_intrp
-
-
-    def interp_kpts_and_save(self, data_kpt_intrp, ind_id):
-        """ Interpolate in between frames """
-        im_an = [] # Anchors used for interpolation
-        kpt_l_u = []
-        kpt_l_v = []
-        kpt_r_u = []
-        kpt_r_v = []
-        for i, (k_key, k_data) in enumerate(natsorted(data_kpt_intrp.items())):
-            if k_data is not None:
-                im_an.append(i)
-                kpt_l_u.append(k_data["k_l"]["u"])
-                kpt_l_v.append(k_data["k_l"]["v"])
-                kpt_r_u.append(k_data["k_r"]["u"])
-                kpt_r_v.append(k_data["k_r"]["v"])
-        i_min = im_an[0]
-        i_max = im_an[-1]
-        i_n = i_max - i_min + 1 # Number of images to interpolate
-        interp_k_l_u = self.get_interp_values(im_an, kpt_l_u, i_min, i_max, i_n)
-        interp_k_l_v = self.get_interp_values(im_an, kpt_l_v, i_min, i_max, i_n)
-        interp_k_r_u = self.get_interp_values(im_an, kpt_r_u, i_min, i_max, i_n)
-        interp_k_r_v = interp_k_l_v # Since images are rectified
-        """ Save interpolation data """
+         Interpolate in between the anchors (kpts that were manually labelled) of a segment.
+
+         The new kpts are added to `intrp_pairs`, a dict {im_name: [(ind_id, u_l, v_l, u_r, v_r)]}.
+         Returns the number of interpolated kpt pairs.
+        """
+        seg = track[i_first:i_last + 1]
+        is_anchor = seg["has_kpt"] & seg["has_uv"] & ~seg["is_interp"]
+        im_an = np.flatnonzero(is_anchor)
+        if len(im_an) < 2: # Need at least 2 points to interpolate
+            return 0
+        inds_im = np.setdiff1d(np.arange(im_an[0] + 1, im_an[-1]), im_an)
+        if inds_im.size == 0:
+            return 0
+        an_loc = np.stack((seg["u_l"][im_an], seg["v_l"][im_an], seg["u_r"][im_an]), axis=1)
+        interp_values = self.get_interp_values(im_an, an_loc, inds_im).astype(int)
+        u_l = interp_values[:, 0]
+        v_l = interp_values[:, 1]
+        u_r = interp_values[:, 2]
+        v_r = v_l # Since images are rectified
         im_h, im_w = self.Images.get_resolution()
-        for i, (k_key, k_val) in enumerate(natsorted(data_kpt_intrp.items())):
-            if k_val is None: # If not an anchor
-                if i > i_min and i < i_max: # If inside the interpolated range
-                    # Replace None by the interpolated value
-                    ind = i - i_min
-                    u_l = int(interp_k_l_u[ind])
-                    v_l = int(interp_k_l_v[ind])
-                    u_r = int(interp_k_r_u[ind])
-                    v_r = int(interp_k_r_v[ind])
-                    if u_l < 0 or u_r < 0:
-                        continue
-                    if u_l > im_w or u_r > im_w:
-                        continue
-                    if v_l > im_h or v_r > im_h:
-                        continue
-                    if v_l < 0 or v_r < 0:
-                        continue
-                    self.Keypoints.update_ktp_pairs(k_key)
-                    self.Keypoints.new_intrp_pair(ind_id, u_l, v_l, u_r, v_r)
+        is_inside = (u_l >= 0) & (u_r >= 0) & (u_l <= im_w) & (u_r <= im_w) & \
+                    (v_l >= 0) & (v_l <= im_h)
+        n_interp = 0
+        for ind, ul, vl, ur, vr in zip(inds_im[is_inside].tolist(),
+                                       u_l[is_inside].tolist(),
+                                       v_l[is_inside].tolist(),
+                                       u_r[is_inside].tolist(),
+                                       v_r[is_inside].tolist()):
+            im_name = self.Images.get_im_pair_name(i_first + ind)
+            intrp_pairs.setdefault(im_name, []).append((ind_id, ul, vl, ur, vr))
+            n_interp += 1
+        return n_interp
 
 
     def start(self, ind_id, ind_im):
-        data_kpt_intrp = self.get_kpt_data_given_id_and_im(ind_id, ind_im)
-        if data_kpt_intrp is None:
+        """ Interpolate the kpts with `ind_id` connected to `ind_im` """
+        track = self.Keypoints.Index.get_track(ind_id)
+        if track is None:
             return
-        self.interp_kpts_and_save(data_kpt_intrp, ind_id)
+        i_first, i_last = self.get_segment(track, ind_im)
+        intrp_pairs = {}
+        if self.interp_segment(track, ind_id, i_first, i_last, intrp_pairs) > 0:
+            self.Keypoints.add_intrp_pairs(intrp_pairs)
+
+
+    def start_all(self):
+        """ Interpolate all the gaps in between anchors, for all the ids, in a single pass """
+        print("Interpolate all ids!")
+        intrp_pairs = {}
+        n_interp = 0
+        n_segments = 0
+        for ind_id in self.Keypoints.Index.get_ids():
+            track = self.Keypoints.Index.get_track(ind_id)
+            for i_first, i_last in self.get_segments(track):
+                n_new = self.interp_segment(track, ind_id, i_first, i_last, intrp_pairs)
+                if n_new > 0:
+                    n_interp += n_new
+                    n_segments += 1
+        self.Keypoints.add_intrp_pairs(intrp_pairs)
+        print("Done! {} keypoint pairs interpolated in {} segments".format(n_interp, n_segments))
+
+
+class Propagation:
+    """
+     Tracks the kpts in between anchors with pyramidal Lucas-Kanade optical flow.
+
+     Each gap is tracked forward from the anchor before it and backward from the anchor
+      after it, in both the left and right images. The two tracks are blended, so that
+      the drift of each one is cancelled at the opposite anchor.
+    """
+    def __init__(self, Images, Keypoints, Interpolation, win_size, max_level, max_err, mem_budget_mb):
+        self.Images = Images
+        self.Keypoints = Keypoints
+        self.Interpolation = Interpolation # Splits the tracks into segments
+        self.Pyramids = frames.PyramidCache(Images.Frames, max_level, mem_budget_mb)
+        self.win_size = (win_size, win_size)
+        self.max_err = max_err
+        self.criteria = (cv.TERM_CRITERIA_EPS | cv.TERM_CRITERIA_COUNT, 30, 0.01)
+
+
+    def track_pt_step(self, pyr_prev, pyr_next, p0):
+        """
+         Pyramidal Lucas-Kanade, from the coarsest level to the original resolution.
+
+         `cv.calcOpticalFlowPyrLK()` would rebuild both pyramids at every call, so instead
+          it is run on each cached level, starting from the flow found at the level above.
+        """
+        p1 = p0 / 2**len(pyr_prev)
+        for level in range(len(pyr_prev) - 1, -1, -1):
+            scale = 2**level
+            p1, status, err = cv.calcOpticalFlowPyrLK(pyr_prev[level], pyr_next[level],
+                                                      p0 / scale, p1 * 2.,
+                                                      winSize=self.win_size,
+                                                      maxLevel=0,
+                                                      criteria=self.criteria,
+                                                      flags=cv.OPTFLOW_USE_INITIAL_FLOW)
+        return p1, status, err
+
+
+    def track_pt(self, inds_im, pt, is_left):
+        """
+         Track `pt` (u, v), located in the first image of `inds_im`, through the other images.
+         Returns the positions (N, 2) and whether the kpt was tracked until each image (N,).
+        """
+        n = len(inds_im)
+        pts = np.zeros((n, 2), dtype=np.float32)
+        is_valid = np.zeros(n, dtype=bool)
+        pts[0] = pt
+        is_valid[0] = True
+        im_h, im_w = self.Images.get_resolution()
+        p0 = np.array([[pt]], dtype=np.float32)
+        pyr_prev = self.Pyramids.get_pyramid(inds_im[0], is_left)
+        for i in range(1, n):
+            pyr_next = self.Pyramids.get_pyramid(inds_im[i], is_left)
+            p1, status, err = self.track_pt_step(pyr_prev, pyr_next, p0)
+            u, v = p1[0, 0]
+            if not status[0, 0] or err[0, 0] > self.max_err or \
+               u < 0 or u > im_w or v < 0 or v > im_h:
+                break # Lost, the next images are left to the other direction
+            pts[i] = (u, v)
+            is_valid[i] = True
+            p0 = p1
+            pyr_prev = pyr_next
+        return pts, is_valid
+
+
+    def track_gap(self, track, i_a, i_b):
+        """
+         Positions (N, 4) of the kpt in the images in between the anchors `i_a` and `i_b`,
+          as (u_l, v_l, u_r, v_r), and which of them could be tracked (N,).
+        """
+        inds_fwd = list(range(i_a, i_b + 1))
+        inds_bwd = inds_fwd[::-1]
+        pos = np.zeros((len(inds_fwd), 4))
+        is_valid = np.ones(len(inds_fwd), dtype=bool)
+        w = np.linspace(0., 1., len(inds_fwd)) # Weight of the backward track
+        for is_left, (col_u, col_v) in [(True, ("u_l", "v_l")), (False, ("u_r", "v_r"))]:
+            pt_a = (track[col_u][i_a], track[col_v][i_a])
+            pt_b = (track[col_u][i_b], track[col_v][i_b])
+            pts_fwd, is_fwd = self.track_pt(inds_fwd, pt_a, is_left)
+            pts_bwd, is_bwd = self.track_pt(inds_bwd, pt_b, is_left)
+            pts_bwd = pts_bwd[::-1]
+            is_bwd = is_bwd[::-1]
+            # Blend where both tracks are valid, otherwise use the valid one
+            w_bwd = np.where(is_fwd & is_bwd, w, is_bwd.astype(float))[:, None]
+            c = 0 if is_left else 2
+            pos[:, c:c + 2] = (1. - w_bwd) * pts_fwd + w_bwd * pts_bwd
+            is_valid &= is_fwd | is_bwd
+        return pos[1:-1], is_valid[1:-1]
+
+
+    def start(self, ind_id, ind_im):
+        """ Propagate the kpts with `ind_id` in between the anchors connected to `ind_im` """
+        track = self.Keypoints.Index.get_track(ind_id)
+        if track is None:
+            return
+        t_start = time.perf_counter()
+        i_first, i_last = self.Interpolation.get_segment(track, ind_im)
+        seg = track[i_first:i_last + 1]
+        is_anchor = seg["has_kpt"] & seg["has_uv"] & ~seg["is_interp"]
+        im_an = np.flatnonzero(is_anchor) + i_first
+        intrp_pairs = {}
+        n_im = 0
+        for i_a, i_b in zip(im_an[:-1], im_an[1:]):
+            if i_b - i_a < 2:
+                continue
+            pos, is_valid = self.track_gap(track, i_a, i_b)
+            n_im += 2 * (i_b - i_a)
+            pos = np.rint(pos).astype(int)
+            for ind, (u_l, v_l, u_r, v_r) in zip(range(i_a + 1, i_b), pos.tolist()):
+                if not is_valid[ind - i_a - 1]:
+                    continue
+                v_r = v_l # Since images are rectified
+                im_name = self.Images.get_im_pair_name(ind)
+                intrp_pairs.setdefault(im_name, []).append((ind_id, u_l, v_l, u_r, v_r))
+        self.Keypoints.add_intrp_pairs(intrp_pairs)
+        t_total = time.perf_counter() - t_start
+        n_kpts = sum(len(pairs) for pairs in intrp_pairs.values())
+        print("Propagated {} keypoint pairs in {:.3f} s ({:.1f} images tracked per second)".format(
+              n_kpts, t_total, n_im / max(t_total, 1e-9)))
 
 
 class GT:
-    def __init__(self, v, Images, Keypoints, radius, file_out):
+    def __init__(self, v, Images, Keypoints, radius, file_out, file_out_npy=None, file_out_mot=None):
         self.video = v
         self.Images = Images
         self.Keypoints = Keypoints
         self.file_out = file_out
+        self.file_out_npy = file_out_npy # Extra formats, not written if `None`
+        self.file_out_mot = file_out_mot
         self.radius = radius
         self.baseline = 1. / self.video.Q[3, 2]
         self.P1 = self.video.P1
@@ -456,7 +650,8 @@ class GT:
 
 
     def get_bbox_from_ellipse(self, ellipse_info):
-        mask = np.zeros((self.Images.im_h, self.Images.im_w), dtype=np.uint8)
+        im_h, im_w = self.Images.get_resolution()
+        mask = np.zeros((im_h, im_w), dtype=np.uint8)
         centre_x, centre_y, a, b, angle = ellipse_info
         mask = cv.ellipse(mask,
                           (int(round(centre_x)), int(round(centre_y))),
@@ -484,7 +679,17 @@ class GT:
         return bbox
 
 
+    @trace.timed("GT.project_sphere_around_kpt")
     def project_sphere_around_kpt(self, kpt_3d, k_l, k_r):
+        bboxs_1, bboxs_2 = self.project_spheres_around_kpts(kpt_3d[np.newaxis],
+                                                            k_l["u"], k_l["v"],
+                                                            k_r["u"], k_r["v"])
+        return tuple(bboxs_1[0].tolist()), tuple(bboxs_2[0].tolist())
+
+
+    def project_sphere_around_kpt_raster(self, kpt_3d, k_l, k_r):
+        """ Slower version of `project_sphere_around_kpt()`, by drawing the ellipses """
+        kpt_3d = kpt_3d.copy()
         H_inv = np.hstack((self.H_inv, kpt_3d))
         H_inv_transp = np.transpose(H_inv)
         Q_ = H_inv_transp @ self.Q @ H_inv
@@ -545,71 +750,272 @@ class GT:
         return bbox1, bbox2
 
 
+    def get_gt(self, ind_im, ind_id):
+        """ (is_visible, is_difficult, bboxs) of an id in an image pair """
+        # Get keypoint's 2D coordinates
+        k_l, k_r = self.Keypoints.Index.get_kpt_pair(ind_im, ind_id)
+        if k_l is None or k_r is None \
+           or not k_l["is_visible_in_both_stereo"] \
+           or not k_r["is_visible_in_both_stereo"]:
+            return (False, False, None)
+        if k_l["is_difficult"] or k_r["is_difficult"]:
+            return (True, True, None)
+        # Get keypoint's 3D point
+        kpt_3d = self.get_kpt_3d_pt(k_l, k_r)
+        # Project sphere into rectified image
+        bboxs = self.project_sphere_around_kpt(kpt_3d, k_l, k_r)
+        # Project 3D points into 2D to get bbox size
+        #bboxs = self.project_3d_into_2d(kpt_3d, k_l, k_r)
+        # Get bbox around mask
+        return (True, False, bboxs)
+
+
+    def open_npy_writer(self, ind_id, n_im):
+        if self.file_out_npy is None:
+            return None
+        return export.NpyWriter(self.file_out_npy.format(ind_id), n_im)
+
+
     def start(self, ind_id):
+        """ Ground-truth of an id. The MOT files have all the ids, so they are only written by `start_all()` """
         print("Get ground truth!")
         out_path = self.file_out.format(ind_id)
         # Loop through images (from 0 until the last frame)
         n_images = self.Images.get_n_im()
+        Npy = self.open_npy_writer(ind_id, n_images)
         data_kpt = {}
         for ind_im in range(n_images):
-            # Get keypoint's 2D coordinates
-            im_name = self.Images.get_im_pair_name(ind_im)
-            self.Keypoints.update_ktp_pairs(im_name)
-            k_l, k_r = self.Keypoints.get_kpts_given_ind_id(ind_id)
-            if k_l is None or k_r is None \
-               or not k_l["is_visible_in_both_stereo"] \
-               or not k_r["is_visible_in_both_stereo"]:
-                data_kpt[ind_im] = (False, False, None)
-                continue
-            if k_l["is_difficult"] or k_r["is_difficult"]:
-                data_kpt[ind_im] = (True, True, None)
-                continue
-            # Get keypoint's 3D point
-            kpt_3d = self.get_kpt_3d_pt(k_l, k_r)
-            # Project sphere into rectified image
-            bboxs = self.project_sphere_around_kpt(kpt_3d, k_l, k_r)
-            # Project 3D points into 2D to get bbox size
-            #bboxs = self.project_3d_into_2d(kpt_3d, k_l, k_r)
-            # Get bbox around mask
-            data_kpt[ind_im] = (True, False, bboxs)
+            data_kpt[ind_im] = self.get_gt(ind_im, ind_id)
+            if Npy is not None:
+                Npy.write(ind_im, *data_kpt[ind_im])
+        if Npy is not None:
+            Npy.close()
         print("Done!")
         utils.write_yaml_data(out_path, data_kpt)
 
 
+    def get_kpt_3d_pts(self, u_l, v_l, u_r):
+        """ Same as `get_kpt_3d_pt()`, for N keypoint pairs at once. Returns a (N, 4, 1) array """
+        disp = u_l - u_r
+        assert(np.all(disp > 0))
+        pts_2d = np.stack((u_l, v_l, disp, np.ones_like(disp)), axis=1).astype(np.float32)
+        pts_3d = np.einsum("ij,nj->ni", self.video.Q, pts_2d)
+        pts_3d /= pts_3d[:, 3:]
+        return pts_3d[:, :, np.newaxis]
+
+
+    def get_dual_conics(self, P, pts_3d):
+        """
+         Project the spheres around N 3D points into an image, as dual conics (N, 3, 3).
+
+         The dual quadric of a sphere with centre X and radius r is:
+                | r^2 I - X X^T   -X |
+                |     -X^T        -1 |
+         and it is projected by a camera matrix P into the dual conic P Q* P^T.
+        """
+        X = pts_3d[:, :3, 0]
+        n = X.shape[0]
+        Q_dual = np.empty((n, 4, 4))
+        Q_dual[:, :3, :3] = self.radius**2 * np.eye(3) - np.einsum("ni,nj->nij", X, X)
+        Q_dual[:, :3, 3] = -X
+        Q_dual[:, 3, :3] = -X
+        Q_dual[:, 3, 3] = -1.
+        return np.einsum("ij,njk,lk->nil", P, Q_dual, P)
+
+
+    def get_bbox_half_sizes(self, C_dual):
+        """
+         Half width and half height of the axis-aligned bbox around each ellipse.
+
+         A line l is tangent to the ellipse if l^T C* l = 0. For the vertical lines
+          l = (1, 0, -x), and with C* normalised so that C*_22 = 1, this gives:
+                x = C*_02 +- sqrt(C*_02^2 - C*_00)
+         and the same for the horizontal lines, using the 2nd row of C*.
+        """
+        C_dual = C_dual / C_dual[:, 2:, 2:]
+        centre = C_dual[:, :2, 2]
+        return np.sqrt(centre**2 - C_dual[:, [0, 1], [0, 1]])
+
+
+    def get_bbox_half_sizes_in_im(self, C_dual):
+        """
+         Same as `get_bbox_half_sizes()`, for the part of each ellipse inside the image.
+         This matches `get_bbox_from_ellipse()`, where the ellipses are cropped when drawn.
+          The bbox sides are then the ellipse's extreme points or where it crosses the image borders,
+          so the bboxs of the kpts close to the image borders are smaller.
+        """
+        C_dual = C_dual / C_dual[:, 2:, 2:]
+        centre = C_dual[:, :2, 2]
+        # Ellipses as (p - centre)^T S^-1 (p - centre) = 1
+        S = np.einsum("ni,nj->nij", centre, centre) - C_dual[:, :2, :2]
+        M = np.linalg.inv(S)
+        im_h, im_w = self.Images.get_resolution()
+        pxl_max = np.array([im_w - 1, im_h - 1])
+        # Extreme points in u and v, at `centre +- S e_k / sqrt(S_kk)`
+        offsets = S / np.sqrt(np.diagonal(S, axis1=1, axis2=2))[:, np.newaxis, :]
+        pts = []
+        for k in [0, 1]:
+            pts.append(centre + offsets[:, :, k])
+            pts.append(centre - offsets[:, :, k])
+        # Crossings with the image borders, by solving the ellipse's equation along each border
+        for a, b in [(0, 1), (1, 0)]:
+            for border in [0, pxl_max[a]]:
+                d_a = border - centre[:, a]
+                disc = (M[:, a, b] * d_a)**2 - M[:, b, b] * (M[:, a, a] * d_a**2 - 1.)
+                for sign in [-1., 1.]:
+                    d_b = (-M[:, a, b] * d_a + sign * np.sqrt(np.maximum(disc, 0.))) / M[:, b, b]
+                    pt = np.empty_like(centre)
+                    pt[:, a] = border
+                    pt[:, b] = np.where(disc >= 0., centre[:, b] + d_b, np.nan)
+                    pts.append(pt)
+        pts = np.stack(pts, axis=1) # (N, n_pts, 2)
+        eps = 1e-6
+        is_inside = np.all((pts >= -eps) & (pts <= pxl_max + eps), axis=2)[:, :, np.newaxis]
+        top_left = np.min(np.where(is_inside, pts, np.inf), axis=1)
+        bot_right = np.max(np.where(is_inside, pts, -np.inf), axis=1)
+        # Ellipses completely outside the image have no bbox
+        return np.where(np.any(is_inside, axis=1), (bot_right - top_left) / 2., 0.)
+
+
+    def centre_bboxs(self, half_sizes, u, v):
+        """ Bboxs with the labelled keypoints as the centre """
+        half_sizes = np.rint(half_sizes).astype(np.int64)
+        half_w = half_sizes[:, 0]
+        half_h = half_sizes[:, 1]
+        return np.stack((u - half_w, v - half_h, half_w * 2, half_h * 2), axis=1)
+
+
+    def project_spheres_around_kpts(self, pts_3d, u_l, v_l, u_r, v_r):
+        """ Same as `project_sphere_around_kpt()`, for N keypoint pairs at once """
+        half_sizes_1 = self.get_bbox_half_sizes_in_im(self.get_dual_conics(self.P1, pts_3d))
+        half_sizes_2 = self.get_bbox_half_sizes_in_im(self.get_dual_conics(self.P2, pts_3d))
+        bboxs_1 = self.centre_bboxs(half_sizes_1, u_l, v_l)
+        bboxs_2 = self.centre_bboxs(half_sizes_2, u_r, v_r)
+        return bboxs_1, bboxs_2
+
+
+    def is_ellipse_inside_im(self, P, kpt_3d):
+        C_dual = self.get_dual_conics(P, kpt_3d[np.newaxis])
+        centre = C_dual[0, :2, 2] / C_dual[0, 2, 2]
+        half_size = self.get_bbox_half_sizes(C_dual)[0]
+        top_left = centre - half_size
+        bot_right = centre + half_size
+        im_h, im_w = self.Images.get_resolution()
+        return top_left[0] > 1 and top_left[1] > 1 and \
+               bot_right[0] < (im_w - 2) and bot_right[1] < (im_h - 2)
+
+
+    def check_bboxs_against_raster(self):
+        """
+         Compare the bboxs of `project_sphere_around_kpt()` with the ones obtained by
+          drawing the ellipses, for all the labelled keypoints.
+         The ellipses touching the image borders are skipped, since the drawing is cropped.
+         The bboxs' sides should agree within 1 pixel.
+
+         Returns the number of bboxs compared and the maximum difference in [pixels].
+        """
+        Index = self.Keypoints.Index
+        n_checked = 0
+        max_diff = 0
+        for ind_id in Index.get_ids():
+            for ind_im in range(self.Images.get_n_im()):
+                k_l, k_r = Index.get_kpt_pair(ind_im, ind_id)
+                if k_l is None or "u" not in k_l:
+                    continue
+                if not k_l["is_visible_in_both_stereo"] or k_l["is_difficult"]:
+                    continue
+                kpt_3d = self.get_kpt_3d_pt(k_l, k_r)
+                bboxs = self.project_sphere_around_kpt(kpt_3d, k_l, k_r)
+                bboxs_raster = self.project_sphere_around_kpt_raster(kpt_3d, k_l, k_r)
+                for P, bbox, bbox_raster in zip([self.P1, self.P2], bboxs, bboxs_raster):
+                    if not self.is_ellipse_inside_im(P, kpt_3d):
+                        continue
+                    n_checked += 1
+                    x, y, w, h = np.subtract(bbox, bbox_raster)
+                    max_diff = max(max_diff, abs(x), abs(y), abs(x + w), abs(y + h))
+        return n_checked, int(max_diff)
+
+
+    def start_all(self):
+        """ Same as `start()`, but for all the ids at once, in a single pass """
+        print("Get ground truth of all ids!")
+        Index = self.Keypoints.Index
+        ids = [ind_id for ind_id in Index.get_ids() if np.any(Index.get_track(ind_id)["has_kpt"])]
+        if not ids:
+            print("Done!")
+            return
+        tracks = np.stack([Index.get_track(ind_id) for ind_id in ids]) # (n_ids, n_im)
+        is_labelled = tracks["has_kpt"] & tracks["is_visible"]
+        is_bbox = is_labelled & ~tracks["is_difficult"]
+        i_ids, ind_ims = np.nonzero(is_bbox) # `i_ids` are indexes into `ids`
+        kpts = tracks[i_ids, ind_ims]
+        # Get keypoints' 3D points, and project the spheres around them into the rectified images
+        pts_3d = self.get_kpt_3d_pts(kpts["u_l"], kpts["v_l"], kpts["u_r"])
+        bboxs_1, bboxs_2 = self.project_spheres_around_kpts(pts_3d,
+                                                            kpts["u_l"],
+                                                            kpts["v_l"],
+                                                            kpts["u_r"],
+                                                            kpts["v_r"])
+        bboxs = {} # (index into `ids`, ind_im) -> bboxs
+        for i_id, ind_im, bbox1, bbox2 in zip(i_ids.tolist(),
+                                              ind_ims.tolist(),
+                                              bboxs_1.tolist(),
+                                              bboxs_2.tolist()):
+            bboxs[(i_id, ind_im)] = (tuple(bbox1), tuple(bbox2))
+        # Save one file per id
+        n_im = tracks.shape[1]
+        for i_id, ind_id in enumerate(ids):
+            Npy = self.open_npy_writer(ind_id, n_im)
+            data_kpt = {}
+            for ind_im in range(n_im):
+                if not is_labelled[i_id, ind_im]:
+                    data_kpt[ind_im] = (False, False, None)
+                elif not is_bbox[i_id, ind_im]:
+                    data_kpt[ind_im] = (True, True, None)
+                else:
+                    data_kpt[ind_im] = (True, False, bboxs[(i_id, ind_im)])
+                if Npy is not None:
+                    Npy.write(ind_im, *data_kpt[ind_im])
+            if Npy is not None:
+                Npy.close()
+            utils.write_yaml_data(self.file_out.format(ind_id), data_kpt)
+        if self.file_out_mot is not None:
+            Mot = export.MotWriter(self.file_out_mot.format("left"), self.file_out_mot.format("right"))
+            for ind_im in range(n_im):
+                for i_id in np.nonzero(is_bbox[:, ind_im])[0].tolist():
+                    Mot.write(ind_im, ids[i_id], bboxs[(i_id, ind_im)])
+            Mot.close()
+        print("Done! {} ids".format(len(ids)))
+
+
 class Draw:
     def __init__(self, config, v):
         self.ind_im = 0
         self.ind_id = 0
         self.is_zoom_on = False
+        self.is_dirty = True # If `True`, the drawing needs to be updated
         self.load_data_config(config, v)
         self.load_vis_config(config)
         self.mouse_u = 0
         self.mouse_v = 0
         self.is_mouse_on_im_l = False
         self.is_mouse_on_im_r = False
+        self.match_suggestion = None # (new left kpt, `u` of the suggested right kpt)
         self.initialize_im()
         self.range_start = -1
         self.range_end   = -1
+        self.frame_time_ms = None # Shown in the status bar, if set
 
 
     def load_data_config(self, config, v):
-        c_data = config["data"]
-        self.dir_data = c_data["dir"]
-        # Images
-        dir_l = os.path.join(self.dir_data, c_data["subdir_stereo_l"])
-        dir_r = os.path.join(self.dir_data, c_data["subdir_stereo_r"])
-        im_format = c_data["im_format"]
-        self.Images = Images(dir_l, dir_r, im_format)
-        # Keypoints
-        dir_out_l = os.path.join(self.dir_data, c_data["subdir_output_l"])
-        dir_out_r = os.path.join(self.dir_data, c_data["subdir_output_r"])
-        self.Keypoints = Keypoints(dir_out_l, dir_out_r)
-        # Interpolation
-        self.Interpolation = Interpolation(self.Images, self.Keypoints)
-        # Ground-truth
-        gt_sph_rad_mm = c_data["gt_sphere_rad_mm"]
-        file_out_gt = os.path.join(self.dir_data, c_data["file_output_gt"])
-        self.GT = GT(v, self.Images, self.Keypoints, gt_sph_rad_mm, file_out_gt)
+        self.dir_data = config["data"]["dir"]
+        self.Images, self.Keypoints, self.Interpolation, self.Propagation, self.GT = load_data(config, v)
+        c_match = config["data"]["match"]
+        self.Matcher = match.RowMatcher(c_match["patch_half_pxl"],
+                                        c_match["band_half_pxl"],
+                                        c_match["max_disp_pxl"],
+                                        c_match["prior_half_pxl"],
+                                        c_match["min_score"])
 
 
     def load_vis_config(self, config):
@@ -627,48 +1033,160 @@ class Draw:
         self.kpt_c_size_pxl = c_kpt["c_size_pxl"]
         self.kpt_color_s = c_kpt["color_s"]
         self.kpt_color_not_s = c_kpt["color_not_s"]
+        self.kpt_color_match = c_kpt["color_match"]
         self.kpt_s_thick_pxl = c_kpt["s_thick_pxl"]
         self.kpt_id_v_marg_pxl = c_kpt["id_v_marg_pxl"]
+        self.bbox_cache = utils.LRUCache(max_size=c_kpt["bbox_cache_size"])
+        self.n_bbox_hits = 0
+        self.n_bbox_misses = 0
+        self.text_scales = utils.LRUCache(max_size=256)
         c_zoom = c_vis["zoom"]
         self.zoom_color = c_zoom["color"]
         self.zoom_r_w_pxl_half = int(c_zoom["rect_w_pxl"] / 2.)
         self.zoom_r_h_pxl_half = int(c_zoom["rect_h_pxl"] / 2.)
         self.zoom_thick_pxl  = c_zoom["thick_pxl"]
+        self.display_max_w_pxl = c_vis["display"]["max_w_pxl"]
 
 
     def initialize_im(self):
         self.n_im = self.Images.get_n_im()
-        self.Images.im_update(self.ind_im)
         self.im_h, self.im_w = self.Images.get_resolution()
+        self.initialize_display_size()
+        self.Images.im_update(self.ind_im)
+        self.initialize_canvas()
         self.zoom_kpt_l  = None
         self.zoom_kpt_r  = None
         self.update_im_with_keypoints(True)
 
 
+    def initialize_display_size(self):
+        """
+         If both images side-by-side are wider than `display_max_w_pxl`, they are shown downscaled.
+         The downscaled images are built in the background, with the prefetched images. The keypoints
+          are still stored in full-resolution coordinates, and the zoom mode shows full-resolution crops.
+        """
+        self.disp_scale = min(1., self.display_max_w_pxl / (2. * self.im_w))
+        self.disp_w = int(round(self.disp_scale * self.im_w))
+        self.disp_h = int(round(self.disp_scale * self.im_h))
+        if self.disp_scale < 1.:
+            self.Images.set_display_size(self.disp_w, self.disp_h)
+
+
+    def initialize_canvas(self):
+        """
+         Buffers allocated once, and re-used for every drawing:
+          - `canvas_kpt`: both images side-by-side, with the keypoints drawn on top;
+          - `canvas`: `canvas_kpt` with the guide lines, plus the status bar at the bottom;
+          - `canvas_zoom`: the zoom-mode crops, plus the status bar at the bottom.
+         The left and right images (e.g. `im_l_kpt`) are views into these buffers.
+         `canvas_kpt` and `canvas` have the display size, `canvas_zoom` is at full resolution.
+        """
+        h = self.disp_h
+        w = self.disp_w
+        im_l, _im_r = self.Images.get_display_pair()
+        n_ch = im_l.shape[2] if im_l.ndim == 3 else 1
+        self.canvas_kpt = np.zeros((h, 2 * w, n_ch), dtype=im_l.dtype)
+        self.canvas = np.zeros((h + self.bar_h_pxl, 2 * w, n_ch), dtype=im_l.dtype)
+        rect_w = 2 * self.zoom_r_w_pxl_half
+        rect_h = 2 * self.zoom_r_h_pxl_half
+        self.canvas_zoom = np.zeros((rect_h + self.bar_h_pxl, 2 * rect_w, n_ch), dtype=im_l.dtype)
+        # Views
+        self.im_l_kpt = self.canvas_kpt[:, :w]
+        self.im_r_kpt = self.canvas_kpt[:, w:]
+        self.im_l_all = self.canvas[:h, :w]
+        self.im_r_all = self.canvas[:h, w:]
+        self.im_l_zoom = self.canvas_zoom[:rect_h, :rect_w]
+        self.im_r_zoom = self.canvas_zoom[:rect_h, rect_w:]
+        self.bar = self.canvas[h:]
+        self.bar_zoom = self.canvas_zoom[rect_h:]
+        self.bar_status = {} # Status currently written in each bar
+        # What is drawn on, indexed by `is_left`
+        self.views_kpt = {True: self.get_view(self.im_l_kpt), False: self.get_view(self.im_r_kpt)}
+        self.views_all = {True: self.get_view(self.im_l_all), False: self.get_view(self.im_r_all)}
+        # Regions of `canvas` covered by the guide lines
+        self.guide_rows = None
+        self.guide_cols = None
+
+
+    def get_view(self, im, scale=None, left=0, top=0):
+        """ An image to draw on, and how it maps from the full-resolution image coordinates """
+        if scale is None:
+            scale = self.disp_scale
+        return im, scale, left, top
+
+
+    def view_pt(self, view, u, v):
+        """ Full-resolution image coordinates -> pixel in the image of `view` """
+        _im, scale, left, top = view
+        return math.floor((u - left + 0.5) * scale), math.floor((v - top + 0.5) * scale)
+
+
+    def view_size(self, view, size):
+        return int(round(size * view[1]))
+
+
+    def display_to_full_image_coords(self, u, v):
+        """ Pixel of `canvas` -> both images side-by-side, in full-resolution coordinates """
+        if self.disp_scale == 1.:
+            return u, v
+        if v >= self.disp_h:
+            return u, self.im_h # Status bar
+        offset_u = 0
+        if u >= self.disp_w:
+            u -= self.disp_w
+            offset_u = self.im_w
+        u = min(int((u + 0.5) / self.disp_scale), self.im_w - 1)
+        v = min(int((v + 0.5) / self.disp_scale), self.im_h - 1)
+        return u + offset_u, v
+
+
     def copy_im_kpt_to_all(self):
-        self.im_l_all = np.copy(self.im_l_kpt)
-        self.im_r_all = np.copy(self.im_r_kpt)
+        np.copyto(self.canvas[:self.disp_h], self.canvas_kpt)
+        self.guide_rows = None
+        self.guide_cols = None
+
+
+    def restore_guide_line(self):
+        """ Remove the previous guide lines, by copying back only the pixels under them """
+        if self.guide_rows is not None:
+            top, bot = self.guide_rows
+            self.canvas[top:bot] = self.canvas_kpt[top:bot]
+        if self.guide_cols is not None:
+            left, right = self.guide_cols
+            self.canvas[:self.disp_h, left:right] = self.canvas_kpt[:, left:right]
 
 
     def im_draw_guide_line(self):
-        self.copy_im_kpt_to_all() # Not to accumulate the guide lines
-        line_thick = self.guide_t
-        color = np.array(self.guide_c, dtype=np.uint8).tolist()
-        v = self.mouse_v
-        pt_l = (0, v)
-        pt_r = (self.im_w, v)
-        cv.line(self.im_l_all, pt_l, pt_r, color, line_thick)
-        cv.line(self.im_r_all, pt_l, pt_r, color, line_thick)
-        u = self.mouse_u
-        pt_t = (u, 0)
-        pt_b = (u, self.im_h)
-        if self.is_mouse_on_im_l:
-            cv.line(self.im_l_all, pt_t, pt_b, color, line_thick)
-        elif self.is_mouse_on_im_r:
-            cv.line(self.im_r_all, pt_t, pt_b, color, line_thick)
+        self.restore_guide_line() # Not to accumulate the guide lines
+        self.im_draw_guide_line_views(self.views_all)
+        u, v = self.view_pt(self.views_all[True], self.mouse_u, self.mouse_v)
+        if self.is_mouse_on_im_r:
+            u += self.disp_w
+        # Save the regions covered by the lines, to be restored in the next mouse move
+        margin = self.guide_t // 2 + 2
+        self.guide_rows = (max(v - margin, 0), min(max(v + margin + 1, 0), self.disp_h))
+        self.guide_cols = None
+        if self.is_mouse_on_im_l or self.is_mouse_on_im_r:
+            self.guide_cols = (max(u - margin, 0), max(u + margin + 1, 0))
 
 
-    def im_draw_kpt_cross(self, im, u, v, color, size_w, size_h):
+    def im_draw_guide_line_views(self, views):
+        line_thick = self.guide_t
+        color = np.array(self.guide_c, dtype=np.uint8).tolist()
+        for is_left, is_mouse_on_im in [(True, self.is_mouse_on_im_l), (False, self.is_mouse_on_im_r)]:
+            im = views[is_left][0]
+            h, w = im.shape[:2]
+            u, v = self.view_pt(views[is_left], self.mouse_u, self.mouse_v)
+            cv.line(im, (0, v), (w, v), color, line_thick)
+            if is_mouse_on_im:
+                cv.line(im, (u, 0), (u, h), color, line_thick)
+
+
+    def im_draw_kpt_cross(self, view, u, v, color, size_w, size_h):
+        im = view[0]
+        u, v = self.view_pt(view, u, v)
+        size_w = self.view_size(view, size_w)
+        size_h = self.view_size(view, size_h)
         # Draw outer square
         s_t = self.kpt_s_thick_pxl
         left_top = (u - size_w, v - size_h)
@@ -684,7 +1202,11 @@ class Draw:
         cv.line(im, pt3, pt4, color, c_t)
 
 
-    def im_draw_kpt_id(self, im, txt, u, v, color, size_w, size_h):
+    def im_draw_kpt_id(self, view, txt, u, v, color, size_w, size_h):
+        im = view[0]
+        u, v = self.view_pt(view, u, v)
+        size_w = self.view_size(view, size_w)
+        size_h = self.view_size(view, size_h)
         left = u - size_w
         bot = v - size_h - self.kpt_id_v_marg_pxl
         font = cv.FONT_HERSHEY_SIMPLEX
@@ -693,10 +1215,18 @@ class Draw:
         cv.putText(im, txt, (left, bot), font, font_scale, color, thickness)
 
 
-    def im_draw_kpt_not_vis(self, im, color):
+    def im_draw_kpt_not_vis(self, view, color):
         s_t = self.kpt_s_thick_pxl
-        cv.line(im, (0, 0), (self.im_w, self.im_h), color, s_t)
-        cv.line(im, (self.im_w, 0), (0, self.im_h), color, s_t)
+        left, top = self.view_pt(view, 0, 0)
+        right, bot = self.view_pt(view, self.im_w, self.im_h)
+        cv.line(view[0], (left, top), (right, bot), color, s_t)
+        cv.line(view[0], (right, top), (left, bot), color, s_t)
+
+
+    def im_draw_kpt_diff(self, view, color):
+        left, top = self.view_pt(view, 0, 0)
+        right, bot = self.view_pt(view, self.im_w, self.im_h)
+        cv.line(view[0], (left, top), (right, bot), color, self.kpt_s_thick_pxl)
 
 
     def limit_u(self, u):
@@ -727,16 +1257,13 @@ class Draw:
         return left, top, right, bot
 
 
-    def im_draw_zoom_mode_rect(self, is_left):
+    def im_draw_zoom_mode_rect(self, view, is_left):
         color = np.array(self.zoom_color, dtype=np.uint8).tolist()
-        im = None
         kpt = None
         if is_left:
             kpt = self.zoom_kpt_l
-            im = self.im_l_kpt
         else:
             kpt = self.zoom_kpt_r
-            im = self.im_r_kpt
         if kpt is None:
             """
              Either the kpt is not visible,
@@ -755,7 +1282,7 @@ class Draw:
             right += thick
         if bot == (self.im_h - 1):
             bot += thick
-        cv.rectangle(im, (left, top), (right, bot), color, thick)
+        cv.rectangle(view[0], self.view_pt(view, left, top), self.view_pt(view, right, bot), color, thick)
 
 
     def zoom_mode_copy_kpt(self, is_left, kpt):
@@ -767,7 +1294,7 @@ class Draw:
             self.zoom_kpt_r = kpt
 
 
-    def im_draw_kpt_pair(self, ind_id, kpt, is_left, bbox=None):
+    def im_draw_kpt_pair(self, views, ind_id, kpt, is_left, bbox=None):
         # Set color
         color = np.array(self.kpt_color_not_s, dtype=np.uint8).tolist()
         if ind_id == self.ind_id:
@@ -781,10 +1308,7 @@ class Draw:
                 if self.is_zoom_on:
                     self.zoom_mode_reset()
                 self.selected_id_not_visible = True
-                if is_left:
-                    self.im_draw_kpt_not_vis(self.im_l_kpt, color)
-                else:
-                    self.im_draw_kpt_not_vis(self.im_r_kpt, color)
+                self.im_draw_kpt_not_vis(views[is_left], color)
             return
         is_difficult = kpt["is_difficult"]
         # Draw \ if is_difficult and return
@@ -793,10 +1317,7 @@ class Draw:
                 if self.is_zoom_on:
                     self.zoom_mode_reset()
                 self.selected_id_is_diff = True
-                if is_left:
-                    cv.line(self.im_l_kpt, (0, 0), (self.im_w, self.im_h), color, self.kpt_s_thick_pxl)
-                else:
-                    cv.line(self.im_r_kpt, (0, 0), (self.im_w, self.im_h), color, self.kpt_s_thick_pxl)
+                self.im_draw_kpt_diff(views[is_left], color)
             return
 
         # Draw keypoint (cross + id)
@@ -813,15 +1334,35 @@ class Draw:
             size_w = int(bbox[2] / 2)
             size_h = int(bbox[3] / 2)
 
-        if is_left:
-            self.im_draw_kpt_cross(self.im_l_kpt, kpt_u, kpt_v, color, size_w, size_h)
-            self.im_draw_kpt_id(self.im_l_kpt, txt, kpt_u, kpt_v, color, size_w, size_h)
-        else:
-            self.im_draw_kpt_cross(self.im_r_kpt, kpt_u, kpt_v, color, size_w, size_h)
-            self.im_draw_kpt_id(self.im_r_kpt, txt, kpt_u, kpt_v, color, size_w, size_h)
+        self.im_draw_kpt_cross(views[is_left], kpt_u, kpt_v, color, size_w, size_h)
+        self.im_draw_kpt_id(views[is_left], txt, kpt_u, kpt_v, color, size_w, size_h)
 
 
-    def im_draw_all_kpts(self):
+    def get_kpt_bboxs(self, kpt_l, kpt_r):
+        """
+         Bboxs around a keypoint pair, memoised by the keypoints' positions.
+         When a keypoint moves its key changes, so old entries are never re-used.
+        """
+        key = (kpt_l["u"], kpt_r["u"], kpt_l["v"], kpt_r["v"], self.GT.radius)
+        bboxs = self.bbox_cache.get(key)
+        if bboxs is not None:
+            self.n_bbox_hits += 1
+            return bboxs
+        self.n_bbox_misses += 1
+        kpt_3d = self.GT.get_kpt_3d_pt(kpt_l, kpt_r)
+        bboxs = self.GT.project_sphere_around_kpt(kpt_3d, kpt_l, kpt_r)
+        self.bbox_cache.put(key, bboxs)
+        return bboxs
+
+
+    def get_bbox_cache_stats_txt(self):
+        n_total = max(self.n_bbox_hits + self.n_bbox_misses, 1)
+        return "Bbox cache: {:.1f}% hits ({}/{})".format(100. * self.n_bbox_hits / n_total,
+                                                         self.n_bbox_hits,
+                                                         self.n_bbox_hits + self.n_bbox_misses)
+
+
+    def im_draw_all_kpts(self, views):
         kpts_l, kpts_r = self.Keypoints.get_kpts()
         self.n_kpt_selected = 0
         self.selected_id_not_visible = False
@@ -833,11 +1374,11 @@ class Draw:
             no_pair_kpt = self.Keypoints.get_kpts_given_ind_id(kpt_key)
             if no_pair_kpt[1] is None:
                 # It is on the left image
-                self.im_draw_kpt_pair(kpt_key, no_pair_kpt[0], True)
+                self.im_draw_kpt_pair(views, kpt_key, no_pair_kpt[0], True)
             else:
                 # It is on the right image
                 kpt_r_val = kpts_r[kpt_key]
-                self.im_draw_kpt_pair(kpt_key, no_pair_kpt[1], False)
+                self.im_draw_kpt_pair(views, kpt_key, no_pair_kpt[1], False)
         # Draw the paired keypoints
         for (kpt_l_key, kpt_l_val), (kpt_r_key, kpt_r_val) in zip(kpts_l.items(), kpts_r.items()):
             bboxs = (None, None)
@@ -845,13 +1386,66 @@ class Draw:
                kpt_r_val["is_visible_in_both_stereo"] and\
                not kpt_l_val["is_difficult"] and\
                not kpt_r_val["is_difficult"]:
-                kpt_3d = self.GT.get_kpt_3d_pt(kpt_l_val, kpt_r_val)
-                bboxs = self.GT.project_sphere_around_kpt(kpt_3d, kpt_l_val, kpt_r_val)
-            self.im_draw_kpt_pair(kpt_l_key, kpt_l_val, True, bboxs[0])
-            self.im_draw_kpt_pair(kpt_r_key, kpt_r_val, False, bboxs[1])
+                bboxs = self.get_kpt_bboxs(kpt_l_val, kpt_r_val)
+            self.im_draw_kpt_pair(views, kpt_l_key, kpt_l_val, True, bboxs[0])
+            self.im_draw_kpt_pair(views, kpt_r_key, kpt_r_val, False, bboxs[1])
+        self.im_draw_match_suggestion(views[False])
         # Draw zoom rectangle
-        self.im_draw_zoom_mode_rect(True) # Left
-        self.im_draw_zoom_mode_rect(False) # Right
+        self.im_draw_zoom_mode_rect(views[True], True) # Left
+        self.im_draw_zoom_mode_rect(views[False], False) # Right
+
+
+    def get_match_suggestion(self):
+        """ `u` of the suggested right kpt, if the new left kpt is still waiting for its pair """
+        if self.match_suggestion is None:
+            return None
+        kpt_n_l, u_r = self.match_suggestion
+        if self.Keypoints.get_new_kpt_l() is not kpt_n_l or self.Keypoints.get_new_kpt_r() is not None:
+            return None
+        return u_r
+
+
+    def im_draw_match_suggestion(self, view):
+        u_r = self.get_match_suggestion()
+        if u_r is None:
+            return
+        v = self.Keypoints.get_new_kpt_l()["v"]
+        color = np.array(self.kpt_color_match, dtype=np.uint8).tolist()
+        size = self.kpt_c_size_pxl
+        self.im_draw_kpt_cross(view, u_r, v, color, size, size)
+
+
+    def get_disp_prior(self):
+        """ Disparity of the selected id in the previous (or next) image pair """
+        track = self.Keypoints.Index.get_track(self.ind_id)
+        if track is None:
+            return None
+        for ind in (self.ind_im - 1, self.ind_im + 1):
+            if 0 <= ind < self.n_im and track["has_kpt"][ind] and track["has_uv"][ind]:
+                return int(track["u_l"][ind] - track["u_r"][ind])
+        return None
+
+
+    def suggest_match(self):
+        """ Search the right kpt of a new left kpt, along the same row """
+        self.match_suggestion = None
+        kpt_n_l = self.Keypoints.get_new_kpt_l()
+        if kpt_n_l is None or self.Keypoints.get_new_kpt_r() is not None:
+            return
+        im_l, im_r = self.Images.get_im_pair()
+        u_r = self.Matcher.suggest(im_l, im_r, kpt_n_l["u"], kpt_n_l["v"], self.get_disp_prior())
+        if u_r is not None:
+            self.match_suggestion = (kpt_n_l, u_r)
+
+
+    def accept_match_suggestion(self):
+        u_r = self.get_match_suggestion()
+        if u_r is None:
+            return
+        v = self.Keypoints.get_new_kpt_l()["v"]
+        self.match_suggestion = None
+        self.Keypoints.new_kpt(False, self.ind_id, u_r, v)
+        self.update_im_with_keypoints(False)
 
 
     def zoom_mode_get_full_image_coords(self, u, v):
@@ -875,6 +1469,8 @@ class Draw:
     def update_mouse_position(self, u, v):
         if self.is_zoom_on:
             u, v = self.zoom_mode_get_full_image_coords(u, v)
+        else:
+            u, v = self.display_to_full_image_coords(u, v)
         # Check if mouse is on left or right image
         self.is_mouse_on_im_l = False
         self.is_mouse_on_im_r = False
@@ -917,6 +1513,7 @@ class Draw:
                                        self.ind_id,
                                        self.mouse_u,
                                        self.mouse_v)
+                self.suggest_match()
                 # Draw new keypoint as well
                 self.update_im_with_keypoints(False)
             elif self.is_zoom_on:
@@ -942,9 +1539,13 @@ class Draw:
 
 
     def get_text_scale_to_fit_height(self, txt, font, thickness):
-        desired_height = self.bar_text_h_pxl
-        _, text_h = cv.getTextSize(txt, font, 1.0, thickness)[0]
-        scale = float(desired_height) / text_h
+        key = (txt, font, thickness)
+        scale = self.text_scales.get(key)
+        if scale is None:
+            desired_height = self.bar_text_h_pxl
+            _, text_h = cv.getTextSize(txt, font, 1.0, thickness)[0]
+            scale = float(desired_height) / text_h
+            self.text_scales.put(key, scale)
         return scale
 
 
@@ -953,11 +1554,23 @@ class Draw:
         return text_w
 
 
-    def add_status_text(self, bar):
-        # Message
-        txt = "Im: [{}/{}]".format(self.ind_im, self.n_im - 1)
+    def get_status(self):
+        txt_im = "Im: [{}/{}]".format(self.ind_im, self.n_im - 1)
         if self.range_start != -1:
-            txt = "Im: [{} -> {}]".format(self.range_start, self.range_end)
+            txt_im = "Im: [{} -> {}]".format(self.range_start, self.range_end)
+        txt_id = " Id: [{}]".format(self.ind_id)
+        txt_frame = ""
+        if self.frame_time_ms is not None:
+            txt_frame = " Frame: {:.1f} ms".format(self.frame_time_ms)
+        return txt_im, txt_id, self.n_kpt_selected > 0, txt_frame
+
+
+    def set_frame_time(self, frame_time_ms):
+        self.frame_time_ms = frame_time_ms
+
+
+    def add_status_text(self, bar, status):
+        txt, txt_id, is_id_selected, txt_frame = status
         # Text specifications
         color = np.array(self.bar_text_c, dtype=np.uint8).tolist()
         font = cv.FONT_HERSHEY_DUPLEX
@@ -969,29 +1582,32 @@ class Draw:
         # Write text
         cv.putText(bar, txt, (left, bot), font, font_scale, color, thickness)
         left += self.get_text_width(txt, font, font_scale, thickness)
-        txt = " Id: [{}]".format(self.ind_id)
-        if self.n_kpt_selected > 0:
+        if is_id_selected:
             color = np.array(self.kpt_color_s, dtype=np.uint8).tolist()
-        cv.putText(bar, txt, (left, bot), font, font_scale, color, thickness)
-        return bar
+        cv.putText(bar, txt_id, (left, bot), font, font_scale, color, thickness)
+        if txt_frame:
+            left += self.get_text_width(txt_id, font, font_scale, thickness)
+            color = np.array(self.bar_text_c, dtype=np.uint8).tolist()
+            cv.putText(bar, txt_frame, (left, bot), font, font_scale, color, thickness)
 
 
-    def add_status_bar(self, draw):
-        # Make black rectangle
-        bar = np.zeros((self.bar_h_pxl, draw.shape[1], 3), dtype=draw.dtype)
-        # Add text status to bar
-        bar = self.add_status_text(bar)
-        draw = np.concatenate((draw, bar), axis=0)
-        return draw
+    def update_status_bar(self, bar, bar_name):
+        """ Re-write the status bar, only if the status changed """
+        status = self.get_status()
+        if self.bar_status.get(bar_name) == status:
+            return
+        bar[:] = 0 # Make black rectangle
+        self.add_status_text(bar, status)
+        self.bar_status[bar_name] = status
 
 
     def update_im_with_keypoints(self, reload_kpt):
-        im_l, im_r = self.Images.get_im_pair()
-        self.im_l_kpt = np.copy(im_l)
-        self.im_r_kpt = np.copy(im_r)
+        im_l, im_r = self.Images.get_display_pair()
+        np.copyto(self.im_l_kpt, im_l.reshape(self.im_l_kpt.shape))
+        np.copyto(self.im_r_kpt, im_r.reshape(self.im_r_kpt.shape))
         if reload_kpt:
             self.load_kpt_data(self.ind_im)
-        self.im_draw_all_kpts()
+        self.im_draw_all_kpts(self.views_kpt)
         self.copy_im_kpt_to_all()
 
 
@@ -1002,6 +1618,7 @@ class Draw:
 
     def im_next(self):
         self.Keypoints.eliminate_unpaired_kpts()
+        self.Keypoints.flush()
         self.ind_im += 1
         if self.ind_im > (self.n_im - 1):
             self.ind_im = 0
@@ -1012,6 +1629,7 @@ class Draw:
 
     def im_prev(self):
         self.Keypoints.eliminate_unpaired_kpts()
+        self.Keypoints.flush()
         self.ind_im -= 1
         if self.ind_im < 0:
             self.ind_im = (self.n_im - 1)
@@ -1041,9 +1659,13 @@ class Draw:
             return
         i_min, i_max = self.get_range_min_and_max()
         if i_min is not None and i_max is not None:
-            for i in range(i_min, i_max + 1):
-                self.load_kpt_data(i)
-                self.Keypoints.eliminate_kpts(self.ind_id)
+            im_names = [self.Images.get_im_pair_name(i) for i in range(i_min, i_max + 1)]
+            with self.Keypoints.edit_session(im_names):
+                for i in range(i_min, i_max + 1):
+                    self.load_kpt_data(i)
+                    self.Keypoints.eliminate_kpts(self.ind_id)
+            # Back to the keypoints of the current image pair (the range can end before it)
+            self.load_kpt_data(self.ind_im)
             self.update_im_with_keypoints(False)
             self.range_toggle()
         else:
@@ -1060,6 +1682,20 @@ class Draw:
         self.update_im_with_keypoints(True)
 
 
+    def propagate_kpt_positions(self):
+        if self.selected_id_not_visible or self.selected_id_is_diff:
+            return
+        self.Propagation.start(self.ind_id, self.ind_im)
+        """ Show the newly propagated keypoints """
+        self.update_im_with_keypoints(True)
+
+
+    def interp_all_kpt_positions(self):
+        self.Interpolation.start_all()
+        """ Show the newly interpolated keypoints """
+        self.update_im_with_keypoints(True)
+
+
     def get_range_min_and_max(self):
         i_min = None
         i_max = None
@@ -1072,9 +1708,12 @@ class Draw:
     def toggle_kpt_visibility(self):
         i_min, i_max = self.get_range_min_and_max()
         if i_min is not None and i_max is not None:
-            for i in range(i_min, i_max + 1):
-                self.load_kpt_data(i)
-                self.Keypoints.toggle_is_visibile(self.ind_id)
+            im_names = [self.Images.get_im_pair_name(i) for i in range(i_min, i_max + 1)]
+            with self.Keypoints.edit_session(im_names):
+                for i in range(i_min, i_max + 1):
+                    self.load_kpt_data(i)
+                    self.Keypoints.toggle_is_visibile(self.ind_id)
+            self.load_kpt_data(self.ind_im)
             self.range_toggle()
         else:
             self.Keypoints.toggle_is_visibile(self.ind_id)
@@ -1084,9 +1723,12 @@ class Draw:
     def toggle_kpt_difficult(self):
         i_min, i_max = self.get_range_min_and_max()
         if i_min is not None and i_max is not None:
-            for i in range(i_min, i_max + 1):
-                self.load_kpt_data(i)
-                self.Keypoints.toggle_is_difficult(self.ind_id)
+            im_names = [self.Images.get_im_pair_name(i) for i in range(i_min, i_max + 1)]
+            with self.Keypoints.edit_session(im_names):
+                for i in range(i_min, i_max + 1):
+                    self.load_kpt_data(i)
+                    self.Keypoints.toggle_is_difficult(self.ind_id)
+            self.load_kpt_data(self.ind_im)
             self.range_toggle()
         else:
             self.Keypoints.toggle_is_difficult(self.ind_id)
@@ -1130,40 +1772,84 @@ class Draw:
         self.zoom_kpt_r = None
 
 
-    def zoom_mode_crop_im(self, im, kpt):
+    def zoom_mode_crop_im(self, crop_im, im, kpt):
+        """ Copy the zoom rectangle from the full-resolution `im`, returns the view to draw on the crop """
         left, top, right, bot = self.zoom_mode_get_rect(kpt)
-        rect_w = 2 * self.zoom_r_w_pxl_half
-        rect_h = 2 * self.zoom_r_h_pxl_half
-        crop_im = np.zeros((rect_h, rect_w, 3), dtype=np.uint8)
-        crop_im[:(bot - top),:(right - left)] = im[top:bot, left:right]
-        return crop_im
+        crop_im[:] = 0
+        crop_im = crop_im[:(bot - top),:(right - left)]
+        crop_im[:] = im[top:bot, left:right].reshape(crop_im.shape)
+        return self.get_view(crop_im, 1., left, top)
+
+
+    def mark_dirty(self):
+        """ Request a new drawing, it can be called from any thread """
+        self.is_dirty = True
 
 
+    def check_and_clear_dirty(self):
+        is_dirty = self.is_dirty
+        self.is_dirty = False
+        return is_dirty
+
+
+    @trace.timed("Draw.get_draw")
     def get_draw(self):
-        # Stack images together
         if self.is_zoom_on:
-            im_l_crop = self.zoom_mode_crop_im(self.im_l_all, self.zoom_kpt_l)
-            im_r_crop = self.zoom_mode_crop_im(self.im_r_all, self.zoom_kpt_r)
-            draw = np.concatenate((im_l_crop, im_r_crop), axis=1)
-        else:
-            draw = np.concatenate((self.im_l_all, self.im_r_all), axis=1)
+            im_l, im_r = self.Images.get_im_pair()
+            views = {True: self.zoom_mode_crop_im(self.im_l_zoom, im_l, self.zoom_kpt_l),
+                     False: self.zoom_mode_crop_im(self.im_r_zoom, im_r, self.zoom_kpt_r)}
+            self.im_draw_all_kpts(views)
+            if self.guide_rows is not None:
+                # Same as in `canvas`, where the guide lines are removed by a new drawing of the keypoints
+                self.im_draw_guide_line_views(views)
+            self.update_status_bar(self.bar_zoom, "zoom")
+            return self.canvas_zoom
         # Add status bar in the bottom
-        draw = self.add_status_bar(draw)
-        return draw
+        self.update_status_bar(self.bar, "main")
+        return self.canvas
 
 
     def save_gtruth(self):
         self.GT.start(self.ind_id)
 
+
+    def save_gtruth_all(self):
+        self.GT.start_all()
+
+
+    def close(self):
+        print(self.get_bbox_cache_stats_txt())
+        print(self.Matcher.get_stats_txt())
+        self.Images.close()
+        self.Keypoints.close()
+
 class Interface:
     def __init__(self, config, v):
         self.load_keys_config(config)
         self.Draw = Draw(config, v)
         c_vis = config["vis"]
         self.window_name = c_vis["window_name"]
+        c_loop = c_vis["loop"]
+        self.wait_min_ms = c_loop["wait_min_ms"]
+        self.wait_max_ms = c_loop["wait_max_ms"]
+        self.n_renders = 0
+        self.t_render = 0.
+        self.t_frame = 0. # Time handling the events of the next frame
+        self.load_trace_config(config)
         self.create_window()
 
 
+    def load_trace_config(self, config):
+        c_trace = config["vis"]["trace"]
+        self.is_trace_on = c_trace["enabled"]
+        self.is_frame_time_shown = c_trace["show_frame_time"]
+        self.file_chrome_trace = None
+        if c_trace["chrome_trace"]:
+            self.file_chrome_trace = os.path.join(config["data"]["dir"], c_trace["file_chrome_trace"])
+        if self.is_trace_on:
+            trace.TRACER.enable(self.file_chrome_trace is not None)
+
+
     def load_keys_config(self, config):
         c_keys = config["key"]
         self.key_quit = c_keys["quit"]
@@ -1173,18 +1859,28 @@ class Interface:
         self.key_id_next = c_keys["id_next"]
         self.key_elimin  = c_keys["elimin"]
         self.key_interp  = c_keys["interp"]
+        self.key_intr_all = c_keys["interp_all"]
+        self.key_propag  = c_keys["propagate"]
+        self.key_match   = c_keys["accept_match"]
         self.key_visibl  = c_keys["visible"]
         self.key_diffic  = c_keys["diffclt"]
         self.key_range   = c_keys["range"]
         self.key_zoom    = c_keys["zoom"]
         self.key_gtruth  = c_keys["gtruth"]
+        self.key_gtr_all = c_keys["gtruth_all"]
 
 
     def mouse_listener(self, event, x, y, flags, param):
+        t_start = time.perf_counter()
         if (event == cv.EVENT_MOUSEMOVE):
-            self.Draw.mouse_move(x, y)
+            with trace.TRACER.span("mouse move"):
+                self.Draw.mouse_move(x, y)
+            self.Draw.mark_dirty()
         elif (event == cv.EVENT_LBUTTONUP):
-            self.Draw.mouse_lclick()
+            with trace.TRACER.span("mouse click"):
+                self.Draw.mouse_lclick()
+            self.Draw.mark_dirty()
+        self.t_frame += time.perf_counter() - t_start
 
 
     def create_window(self):
@@ -1193,6 +1889,13 @@ class Interface:
 
 
     def check_key_pressed(self, key_pressed):
+        t_start = time.perf_counter()
+        with trace.TRACER.span("key '{}'".format(chr(key_pressed & 0xFF))):
+            self.handle_key_pressed(key_pressed)
+        self.t_frame += time.perf_counter() - t_start
+
+
+    def handle_key_pressed(self, key_pressed):
         if key_pressed == ord(self.key_im_next):
             self.Draw.im_next()
             self.Draw.range_update()
@@ -1207,6 +1910,12 @@ class Interface:
             self.Draw.eliminate_selected_kpts()
         elif key_pressed == ord(self.key_interp):
             self.Draw.interp_kpt_positions()
+        elif key_pressed == ord(self.key_intr_all):
+            self.Draw.interp_all_kpt_positions()
+        elif key_pressed == ord(self.key_propag):
+            self.Draw.propagate_kpt_positions()
+        elif key_pressed == ord(self.key_match):
+            self.Draw.accept_match_suggestion()
         elif key_pressed == ord(self.key_visibl):
             self.Draw.toggle_kpt_visibility()
         elif key_pressed == ord(self.key_diffic):
@@ -1217,28 +1926,81 @@ class Interface:
             self.Draw.zoom_mode_toggle()
         elif key_pressed == ord(self.key_gtruth):
             self.Draw.save_gtruth()
+        elif key_pressed == ord(self.key_gtr_all):
+            self.Draw.save_gtruth_all()
+
+
+    def render(self):
+        t_start = time.perf_counter()
+        draw = self.Draw.get_draw()
+        cv.imshow(self.window_name, draw)
+        t_render = time.perf_counter() - t_start
+        self.t_render += t_render
+        self.n_renders += 1
+        if self.is_frame_time_shown:
+            # Shown in the next frame's status bar
+            self.Draw.set_frame_time(1000. * (self.t_frame + t_render))
+        self.t_frame = 0.
+
+
+    def get_render_stats_txt(self):
+        t_per_frame_ms = 1000. * self.t_render / max(self.n_renders, 1)
+        return "Rendering: {} frames, {:.2f} ms per frame".format(self.n_renders, t_per_frame_ms)
 
 
-    def main_loop(self):
-        """ Interface's main loop """
+    def main_loop(self, t_launch=None):
+        """
+         Interface's main loop
+
+         The window is only re-drawn after something changed (e.g. mouse moved or key pressed).
+         While nothing changes, the time waiting for events grows up to `wait_max_ms`,
+          so that the loop does not keep the CPU busy.
+         If given, `t_launch` (`time.perf_counter()` when the program started) is used to report
+          the time until the first frame is shown.
+        """
         key_pressed = None
+        wait_ms = self.wait_min_ms
         while key_pressed != ord(self.key_quit):
-            draw = self.Draw.get_draw()
-            cv.imshow(self.window_name, draw)
-            key_pressed = cv.waitKey(1)
-            self.check_key_pressed(key_pressed)
+            if self.Draw.check_and_clear_dirty():
+                self.render()
+                wait_ms = self.wait_min_ms
+                if t_launch is not None:
+                    cv.pollKey() # Let the window show the frame before measuring
+                    print("First frame shown {:.2f} s after launch".format(time.perf_counter() - t_launch))
+                    t_launch = None
+            else:
+                wait_ms = min(2 * wait_ms, self.wait_max_ms)
+            key_pressed = cv.waitKey(wait_ms)
+            if key_pressed != -1:
+                self.check_key_pressed(key_pressed)
+                self.Draw.mark_dirty()
+        print(self.get_render_stats_txt())
+        if self.is_trace_on:
+            print(trace.TRACER.get_histograms_txt())
+            if self.file_chrome_trace is not None:
+                trace.TRACER.save_chrome_trace(self.file_chrome_trace)
+                print("Trace saved in {}".format(self.file_chrome_trace))
+        self.Draw.close()
 
 
 class Video:
-    def __init__(self, calib_path, vid_path, vid_stack, is_to_rect, dir_l, dir_r, im_format):
+    def __init__(self, calib_path, vid_path, vid_stack, is_to_rect, dir_l, dir_r, im_format, frame_store, n_workers, vid_cache_size,
+                 dir_rect_cache, map_type, path_manifest):
         # Load calibration data
         self.load_calib_data(calib_path)
         self.stack_type = vid_stack
-        self.get_im_size(vid_path)
-        self.stereo_rectify()
-        self.get_rectification_maps()
-        # Get frames if needed
+        self.vid_path = vid_path
+        self.vid_cache_size = vid_cache_size
+        self.map_type = map_type
+        self.RectCache = rectify.RectCache(dir_rect_cache)
         self.is_to_rectify = is_to_rect
+        self.frame_store = frame_store
+        self.n_workers = n_workers
+        self.path_manifest = path_manifest
+        # The video is only opened if the frames still need to be extracted from it
+        self.is_extracted = frame_store != "video" and frames.has_frames(frame_store, dir_l, dir_r, im_format)
+        self.load_rectification(calib_path, vid_path, dir_l, dir_r, im_format)
+        # Get frames if needed
         self.get_frames_if_needed(dir_l, dir_r, vid_path, vid_stack, im_format)
 
 
@@ -1256,11 +2018,14 @@ class Video:
                 print("Error: unrecognized video type {}".format(self.stack_type))
         else:
             print("Error: failed to load video {}".format(vid_path))
-            exit()
+            exit(1)
         cap.release()
 
 
     def load_calib_data(self, calib_path):
+        if not os.path.isfile(calib_path):
+            print("Error: calibration file {} not found".format(calib_path))
+            exit(1)
         fs = cv.FileStorage(calib_path, cv.FILE_STORAGE_READ)
         self.r = np.array(fs.getNode('R').mat(), dtype=np.float64)
         self.t = np.array(fs.getNode('T').mat()[0], dtype=np.float64)
@@ -1270,6 +2035,44 @@ class Video:
         self.d2 = np.array(fs.getNode('D2').mat()[0], dtype=np.float64)
 
 
+    def load_rectification(self, calib_path, vid_path, dir_l, dir_r, im_format):
+        """ Load the image size and rectification from the cache, or compute and save them """
+        if self.is_extracted:
+            self.im_h, self.im_w = frames.get_resolution(self.frame_store, dir_l, dir_r, im_format, self.path_manifest)
+        else:
+            im_size = self.RectCache.load_im_size(vid_path, self.stack_type)
+            if im_size is None:
+                self.get_im_size(vid_path)
+                self.RectCache.save_im_size(vid_path, self.stack_type, self.im_h, self.im_w)
+            else:
+                self.im_h, self.im_w = im_size
+        self.dir_rect = self.RectCache.get_rect_dir(calib_path, self.im_h, self.im_w, self.map_type)
+        data = self.RectCache.load_rect(self.dir_rect, rectify.MATRIX_KEYS)
+        if data is None:
+            self.stereo_rectify()
+            data = {key: getattr(self, key) for key in rectify.MATRIX_KEYS}
+            self.RectCache.save_rect(self.dir_rect, data)
+        else:
+            for key, value in data.items():
+                setattr(self, key, value)
+        self.is_maps_loaded = False # The maps are only loaded if frames need to be rectified
+
+
+    def load_rectification_maps(self):
+        """ Load the rectification maps from the cache, or compute and save them """
+        if self.is_maps_loaded:
+            return
+        data = self.RectCache.load_rect(self.dir_rect, rectify.MAP_KEYS)
+        if data is None:
+            self.get_rectification_maps()
+            data = {key: getattr(self, key) for key in rectify.MAP_KEYS}
+            self.RectCache.save_rect(self.dir_rect, data)
+        else:
+            for key, value in data.items():
+                setattr(self, key, value)
+        self.is_maps_loaded = True
+
+
     def stereo_rectify(self):
         self.R1, self.R2, self.P1, self.P2, self.Q, _roi1, _roi2 = \
             cv.stereoRectify(cameraMatrix1=self.m1,
@@ -1303,9 +2106,16 @@ class Video:
                                        size=(self.im_w, self.im_h),
                                        m1type=cv.CV_32FC1
                                       )
+        if self.map_type == "fixed":
+            # Fixed-point maps, faster to remap: `mapX_x` has the integer coords, `mapX_y` the interpolation table
+            self.map1_x, self.map1_y = cv.convertMaps(self.map1_x, self.map1_y, cv.CV_16SC2)
+            self.map2_x, self.map2_y = cv.convertMaps(self.map2_x, self.map2_y, cv.CV_16SC2)
+        elif self.map_type != "float":
+            print("Error: unrecognized map type `{}`!".format(self.map_type))
+            exit(1)
 
 
-    def split_frame(self, frame):
+    def split_frame(self, frame, dst1=None, dst2=None):
         if self.stack_type == "vertical":
             im1 = frame[:self.im_h, :]
             im2 = frame[self.im_h:, :]
@@ -1313,37 +2123,209 @@ class Video:
             im1 = frame[:, :self.im_w]
             im2 = frame[:, self.im_w:]
         else:
-            print("Error: unrecognized stack type `{}`!".format(stack_type))
-            exit()
+            print("Error: unrecognized stack type `{}`!".format(self.stack_type))
+            exit(1)
         if self.is_to_rectify:
-            im1 = cv.remap(im1, self.map1_x, self.map1_y, cv.INTER_LINEAR)
-            im2 = cv.remap(im2, self.map2_x, self.map2_y, cv.INTER_LINEAR)
+            # `dst1` and `dst2` are optional output buffers, re-used between frames
+            im1 = cv.remap(im1, self.map1_x, self.map1_y, cv.INTER_LINEAR, dst=dst1)
+            im2 = cv.remap(im2, self.map2_x, self.map2_y, cv.INTER_LINEAR, dst=dst2)
         return im1, im2
 
 
-    def get_frames_if_needed(self, dir_l, dir_r, vid_path, vid_stack, im_format):
-        if os.path.isdir(dir_l) and os.path.isdir(dir_r):
+    def save_frame_pair(self, dir_l, dir_r, im_format, frame_counter, frame, dst1=None, dst2=None):
+        im1, im2 = self.split_frame(frame, dst1, dst2)
+        if self.frame_store == "raw":
+            self.raw_writer_l.write(frame_counter, im1)
+            self.raw_writer_r.write(frame_counter, im2)
             return
-        # Make output dirs
-        os.mkdir(dir_l)
-        os.mkdir(dir_r)
-        # Go thourgh each frame
-        print("Getting frames from video...")
-        cap = cv.VideoCapture(vid_path)
+        # Encoded in memory, to get the checksums of the files for the manifest
+        im_name = "{}{}".format(frames.get_im_name(frame_counter), im_format)
+        checksums = []
+        for dir_side, im in [(dir_l, im1), (dir_r, im2)]:
+            ret, data = cv.imencode(im_format, im)
+            if not ret:
+                print("Error: failed to encode frame {}".format(frame_counter))
+                exit(1)
+            with open(os.path.join(dir_side, im_name), "wb") as f_tmp:
+                f_tmp.write(data)
+            checksums.append(manifest.get_checksum(data))
+        self.checksums[frame_counter] = checksums
+
+
+    def extract_frames_serial(self, cap, dir_l, dir_r, im_format):
         frame_counter = 0
         while cap.isOpened():
             ret, frame = cap.read()
             if not ret:
                 break
-            im1, im2 = self.split_frame(frame)
-            im1_path = os.path.join(dir_l, "{:04}.png".format(frame_counter)) # TODO: hardcoded 4 padded zeros
-            cv.imwrite(im1_path, im1)
-            im2_path = os.path.join(dir_r, "{:04}.png".format(frame_counter))
-            cv.imwrite(im2_path, im2)
+            self.save_frame_pair(dir_l, dir_r, im_format, frame_counter, frame)
+            frame_counter += 1
+        return frame_counter
 
+
+    def extract_frames_parallel(self, cap, dir_l, dir_r, im_format):
+        """
+         Pipelined extraction:
+          - The main thread decodes the video and feeds a bounded queue;
+          - `self.n_workers` threads split, rectify and write the frames.
+
+         `cv.remap` and `cv.imwrite` release the GIL, so threads run in parallel
+          without having to copy every frame into another process.
+         The decoded frames and the rectified images are written into buffers
+          that are re-used, instead of allocating new ones for each frame.
+        """
+        n_buffers = 2 * self.n_workers
+        q_work = queue.Queue(maxsize=n_buffers)
+        q_free = queue.Queue() # Frame buffers that can be re-used by the decoder
+        for _ in range(n_buffers):
+            q_free.put(None)
+        errors = []
+
+        def worker():
+            dst1 = None
+            dst2 = None
+            while True:
+                item = q_work.get()
+                if item is None:
+                    break
+                frame_counter, frame = item
+                try:
+                    if not errors:
+                        self.save_frame_pair(dir_l, dir_r, im_format, frame_counter, frame, dst1, dst2)
+                        if self.is_to_rectify and dst1 is None:
+                            dst1 = np.empty((self.im_h, self.im_w, frame.shape[2]), dtype=frame.dtype)
+                            dst2 = np.empty_like(dst1)
+                except Exception as e:
+                    errors.append(e)
+                q_free.put(frame)
+
+        workers = [threading.Thread(target=worker, daemon=True) for _ in range(self.n_workers)]
+        for w in workers:
+            w.start()
+        frame_counter = 0
+        while cap.isOpened() and not errors:
+            buf = q_free.get()
+            ret, frame = cap.read(buf)
+            if not ret:
+                break
+            q_work.put((frame_counter, frame))
             frame_counter += 1
-        print("Finished!")
+        for _ in workers:
+            q_work.put(None)
+        for w in workers:
+            w.join()
+        if errors:
+            raise errors[0]
+        return frame_counter
+
+
+    def get_frames_if_needed(self, dir_l, dir_r, vid_path, vid_stack, im_format):
+        if self.frame_store == "video":
+            # Frames are read on-demand from the video
+            if self.is_to_rectify:
+                self.load_rectification_maps()
+            return
+        if self.is_extracted:
+            return
+        if self.is_to_rectify:
+            self.load_rectification_maps()
+        # Make output dirs (they already exist if the frames were extracted into another store)
+        os.makedirs(dir_l, exist_ok=True)
+        os.makedirs(dir_r, exist_ok=True)
+        # Go thourgh each frame
+        print("Getting frames from video...")
+        t_start = time.perf_counter()
+        cap = cv.VideoCapture(vid_path)
+        if self.frame_store == "raw":
+            self.raw_writer_l = frames.RawFramesWriter(dir_l)
+            self.raw_writer_r = frames.RawFramesWriter(dir_r)
+        self.checksums = {} # Frame index -> checksums of the left and right files
+        if self.n_workers > 1:
+            n_frames = self.extract_frames_parallel(cap, dir_l, dir_r, im_format)
+        else:
+            n_frames = self.extract_frames_serial(cap, dir_l, dir_r, im_format)
         cap.release()
+        if self.frame_store == "raw":
+            self.raw_writer_l.close(n_frames)
+            self.raw_writer_r.close(n_frames)
+        else:
+            self.save_manifest(dir_l, dir_r, im_format, n_frames)
+        t_elapsed = time.perf_counter() - t_start
+        print("Finished! {} frames in {:.1f} s ({:.1f} fps)".format(n_frames,
+                                                                     t_elapsed,
+                                                                     n_frames / max(t_elapsed, 1e-9)))
+
+
+    def save_manifest(self, dir_l, dir_r, im_format, n_frames):
+        names = [frames.get_im_name(i) for i in range(n_frames)]
+        Manifest = manifest.FrameManifest(dir_l,
+                                          dir_r,
+                                          im_format,
+                                          names,
+                                          self.im_h,
+                                          self.im_w,
+                                          [self.checksums[i][0] for i in range(n_frames)],
+                                          [self.checksums[i][1] for i in range(n_frames)])
+        Manifest.save(self.path_manifest)
+
+
+def load_data(config, v):
+    """ Load the images, keypoints, interpolation, propagation and ground-truth, used with or without interface """
+    c_data = config["data"]
+    dir_data = c_data["dir"]
+    # Images
+    dir_l = os.path.join(dir_data, c_data["subdir_stereo_l"])
+    dir_r = os.path.join(dir_data, c_data["subdir_stereo_r"])
+    im_format = c_data["im_format"]
+    frame_store = c_data["frame_store"]
+    c_cache = c_data["cache"]
+    Images_ = Images(dir_l,
+                     dir_r,
+                     im_format,
+                     frame_store,
+                     v,
+                     c_cache["n_prefetch"],
+                     c_cache["n_workers"],
+                     c_cache["mem_budget_mb"],
+                     os.path.join(dir_data, c_data["file_manifest"]))
+    # Keypoints
+    dir_out_l = os.path.join(dir_data, c_data["subdir_output_l"])
+    dir_out_r = os.path.join(dir_data, c_data["subdir_output_r"])
+    path_db = os.path.join(dir_data, c_data["file_output_db"])
+    c_autosave = c_data["autosave"]
+    path_journal = None
+    if c_autosave["write_behind"]:
+        path_journal = os.path.join(dir_data, c_autosave["file_journal"])
+    kpt_store = store.open_store(c_data["kpt_store"],
+                                 dir_out_l,
+                                 dir_out_r,
+                                 path_db,
+                                 path_journal,
+                                 c_autosave["delay_s"])
+    im_names = [Images_.get_im_pair_name(i) for i in range(Images_.get_n_im())]
+    Keypoints_ = Keypoints(kpt_store, im_names)
+    # Interpolation
+    Interpolation_ = Interpolation(Images_, Keypoints_)
+    c_flow = c_data["flow"]
+    Propagation_ = Propagation(Images_,
+                               Keypoints_,
+                               Interpolation_,
+                               c_flow["win_size"],
+                               c_flow["max_level"],
+                               c_flow["max_err"],
+                               c_flow["mem_budget_mb"])
+    # Ground-truth
+    gt_sph_rad_mm = c_data["gt_sphere_rad_mm"]
+    file_out_gt = os.path.join(dir_data, c_data["file_output_gt"])
+    c_export = c_data["gt_export"]
+    file_out_npy = None
+    if c_export["npy"]:
+        file_out_npy = os.path.join(dir_data, c_export["file_npy"])
+    file_out_mot = None
+    if c_export["mot"]:
+        file_out_mot = os.path.join(dir_data, c_export["file_mot"])
+    GT_ = GT(v, Images_, Keypoints_, gt_sph_rad_mm, file_out_gt, file_out_npy, file_out_mot)
+    return Images_, Keypoints_, Interpolation_, Propagation_, GT_
 
 
 def download_video_frames_and_rectify(config):
@@ -1361,11 +2343,78 @@ def download_video_frames_and_rectify(config):
     dir_r = config_d['subdir_stereo_r']
     dir_r = os.path.join(dir_data, dir_r)
     im_format = config_d['im_format']
-    v = Video(calib_path, vid_path, vid_stack, is_to_rect, dir_l, dir_r, im_format)
+    frame_store = config_d['frame_store']
+    n_workers = config_d['n_workers']
+    vid_cache_size = config_d['vid_cache_size']
+    c_rect = config_d['rect_cache']
+    dir_rect_cache = os.path.join(dir_data, c_rect['dir'])
+    map_type = c_rect['map_type']
+    path_manifest = os.path.join(dir_data, config_d['file_manifest'])
+    v = Video(calib_path, vid_path, vid_stack, is_to_rect, dir_l, dir_r, im_format, frame_store, n_workers, vid_cache_size,
+              dir_rect_cache, map_type, path_manifest)
     return v
 
 
-def label_data(config):
+def export_kpts_to_yaml(config):
+    """ Write the keypoints of the SQLite database into the .yaml layout """
+    c_data = config["data"]
+    dir_data = c_data["dir"]
+    dir_out_l = os.path.join(dir_data, c_data["subdir_output_l"])
+    dir_out_r = os.path.join(dir_data, c_data["subdir_output_r"])
+    path_db = os.path.join(dir_data, c_data["file_output_db"])
+    if not os.path.isfile(path_db):
+        print("Error: database {} not found".format(path_db))
+        exit(1)
+    store_db = store.SqliteStore(path_db)
+    n_im = store.copy_kpts(store_db, store.YamlStore(dir_out_l, dir_out_r))
+    store_db.close()
+    print("Exported the keypoints of {} image pairs into {} and {}".format(n_im, dir_out_l, dir_out_r))
+
+
+def interpolate_all(config):
+    """ Interpolate all the gaps of all the ids, without opening the interface """
+    v = download_video_frames_and_rectify(config)
+    Images_, Keypoints_, Interpolation_, _, _ = load_data(config, v)
+    Interpolation_.start_all()
+    Images_.close()
+    Keypoints_.close()
+
+
+def export_gt(config, ind_id=None, v=None):
+    """ Write the ground-truth of one id (or of all ids), without opening the interface """
+    if v is None:
+        v = download_video_frames_and_rectify(config)
+    Images_, Keypoints_, _, _, GT_ = load_data(config, v)
+    if ind_id is None:
+        GT_.start_all()
+    else:
+        GT_.start(ind_id)
+    Images_.close()
+    Keypoints_.close()
+
+
+def validate(config):
+    """ Check the labelled keypoints and the ground-truth bboxs, returns `True` if no problem is found """
+    v = download_video_frames_and_rectify(config)
+    Images_, Keypoints_, _, _, GT_ = load_data(config, v)
+    invalid = Keypoints_.Index.get_invalid_kpts()
+    for ind_im, ind_id, reason in invalid:
+        print("Error: id {} in image pair {}, {}".format(ind_id, Images_.get_im_pair_name(ind_im), reason))
+    names_bad = Images_.verify_frames()
+    for im_name in names_bad:
+        print("Error: image pair {} does not match the checksums of the manifest".format(im_name))
+    n_checked, max_diff = GT_.check_bboxs_against_raster()
+    print("Found {} invalid keypoint pairs".format(len(invalid)))
+    print("Found {} image pairs not matching the manifest".format(len(names_bad)))
+    print("Checked {} bboxs against the drawn ellipses, maximum difference {} pixels".format(n_checked, max_diff))
+    if max_diff > 1:
+        print("Error: the bboxs should agree within 1 pixel")
+    Images_.close()
+    Keypoints_.close()
+    return not invalid and not names_bad and max_diff <= 1
+
+
+def label_data(config, t_launch=None):
     v = download_video_frames_and_rectify(config)
     inter = Interface(config, v)
-    inter.main_loop()
+    inter.main_loop(t_launch)
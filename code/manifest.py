@@ -0,0 +1,149 @@
+import glob
+import hashlib
+import json
+import os
+
+import cv2 as cv
+from natsort import natsorted
+
+
+MANIFEST_VERSION = 1
+
+
+def get_checksum(data):
+    """ Checksum of an encoded image, in memory """
+    return hashlib.sha1(data).hexdigest()
+
+
+def get_file_checksum(path):
+    with open(path, "rb") as f_tmp:
+        return get_checksum(f_tmp.read())
+
+
+def get_dirs_mtime_ns(dir_l, dir_r):
+    # Adding, removing or renaming a file in a directory updates its modification time
+    return [os.stat(dir_l).st_mtime_ns, os.stat(dir_r).st_mtime_ns]
+
+
+class FrameManifest:
+    """
+     Index of the image files of a dataset, written when the frames are extracted:
+      - Frame index, name, left and right file and content checksum of each image pair;
+      - Resolution of each stereo image.
+
+     At startup, it is only checked against the modification time of the image directories,
+      instead of listing and sorting all the files. Then, name and index are looked up
+      in both directions without touching the disk.
+     The file names are relative to the image directories, so the dataset can be moved.
+    """
+    def __init__(self, dir_l, dir_r, im_format, names, im_h, im_w, checksums_l=None, checksums_r=None):
+        self.dir_l = dir_l
+        self.dir_r = dir_r
+        self.im_format = im_format
+        self.names = names
+        self.name_to_ind = {name: ind_im for ind_im, name in enumerate(names)}
+        self.im_h = im_h
+        self.im_w = im_w
+        self.checksums_l = checksums_l # `None` if the frames were not extracted by the tool, or changed since
+        self.checksums_r = checksums_r
+
+
+    def get_n_im(self):
+        return len(self.names)
+
+
+    def get_im_name(self, ind_im):
+        return self.names[ind_im]
+
+
+    def get_ind_im(self, im_name):
+        """ Index of the image pair `im_name`, or `None` if there is no such image pair """
+        return self.name_to_ind.get(im_name)
+
+
+    def get_resolution(self):
+        return self.im_h, self.im_w
+
+
+    def get_paths(self, ind_im):
+        file_name = "{}{}".format(self.names[ind_im], self.im_format)
+        return os.path.join(self.dir_l, file_name), os.path.join(self.dir_r, file_name)
+
+
+    def save(self, path):
+        data = {"version": MANIFEST_VERSION,
+                "dirs_mtime_ns": get_dirs_mtime_ns(self.dir_l, self.dir_r),
+                "im_format": self.im_format,
+                "im_h": self.im_h,
+                "im_w": self.im_w,
+                "names": self.names,
+                "checksums_l": self.checksums_l,
+                "checksums_r": self.checksums_r}
+        path_tmp = "{}.tmp".format(path)
+        with open(path_tmp, "w") as f_tmp:
+            json.dump(data, f_tmp)
+        os.replace(path_tmp, path)
+
+
+    def verify(self):
+        """ Names of the image pairs whose files do not match their checksum (slow, reads all the images) """
+        if self.checksums_l is None:
+            return []
+        names_bad = []
+        for ind_im, name in enumerate(self.names):
+            path_l, path_r = self.get_paths(ind_im)
+            if not os.path.isfile(path_l) \
+               or not os.path.isfile(path_r) \
+               or get_file_checksum(path_l) != self.checksums_l[ind_im] \
+               or get_file_checksum(path_r) != self.checksums_r[ind_im]:
+                names_bad.append(name)
+        return names_bad
+
+
+def load_manifest(path, dir_l, dir_r, im_format):
+    """ The manifest saved in `path`, or `None` if there is none or the image directories changed since """
+    if not os.path.isfile(path):
+        return None
+    with open(path) as f_tmp:
+        data = json.load(f_tmp)
+    if data.get("version") != MANIFEST_VERSION \
+       or data["im_format"] != im_format \
+       or data["dirs_mtime_ns"] != get_dirs_mtime_ns(dir_l, dir_r):
+        return None
+    return FrameManifest(dir_l,
+                         dir_r,
+                         im_format,
+                         data["names"],
+                         data["im_h"],
+                         data["im_w"],
+                         data["checksums_l"],
+                         data["checksums_r"])
+
+
+def scan_manifest(dir_l, dir_r, im_format):
+    """ Manifest built from the files in the image directories, for frames that were not extracted by the tool """
+    names = []
+    for dir_side in [dir_l, dir_r]:
+        files = glob.glob(os.path.join(dir_side, "*{}".format(im_format)))
+        names.append(natsorted(os.path.basename(path)[:-len(im_format)] for path in files))
+    if names[0] != names[1]:
+        print("Error: the left and right images in {} and {} do not match".format(dir_l, dir_r))
+        exit(1)
+    im_h = im_w = -1
+    if names[0]:
+        path = os.path.join(dir_l, "{}{}".format(names[0][0], im_format))
+        im = cv.imread(path, -1)
+        if im is None:
+            print("Error: failed to read the image {}".format(path))
+            exit(1)
+        im_h, im_w = im.shape[:2]
+    return FrameManifest(dir_l, dir_r, im_format, names[0], im_h, im_w)
+
+
+def open_manifest(path, dir_l, dir_r, im_format):
+    """ Loads the manifest, or re-builds and saves it if it is missing or outdated """
+    Manifest = load_manifest(path, dir_l, dir_r, im_format)
+    if Manifest is None:
+        Manifest = scan_manifest(dir_l, dir_r, im_format)
+        Manifest.save(path)
+    return Manifest
@@ -0,0 +1,74 @@
+import time
+
+import cv2 as cv
+import numpy as np
+
+
+class RowMatcher:
+    """
+     Suggests where a left kpt is in the right image, using normalised cross-correlation
+      of a patch around it, along the same row (since the images are rectified).
+
+     Only positive disparities are searched. If the disparity of the kpt in a neighbouring
+      image pair is known, the search starts around it, and only goes through the whole
+      row if nothing similar enough is found there.
+    """
+    def __init__(self, patch_half_pxl, band_half_pxl, max_disp_pxl, prior_half_pxl, min_score):
+        self.p = patch_half_pxl
+        self.b = band_half_pxl
+        self.max_disp = max_disp_pxl
+        self.prior_half = prior_half_pxl
+        self.min_score = min_score
+        # Statistics
+        self.n_searches = 0
+        self.t_search = 0.
+
+
+    def to_gray(self, im):
+        if im.ndim == 3:
+            return cv.cvtColor(im, cv.COLOR_BGR2GRAY)
+        return im
+
+
+    def search(self, im_l, im_r, u, v, d_min, d_max):
+        """ Best disparity in [`d_min`, `d_max`], and its score, or (None, -1.) """
+        p = self.p
+        im_h, im_w = im_l.shape[:2]
+        if u - p < 0 or u + p >= im_w or v - p < 0 or v + p >= im_h:
+            return None, -1. # Patch not fully inside the image
+        # Centres of the candidate patches in the right image
+        u_r_min = max(u - d_max, p)
+        u_r_max = min(u - d_min, im_w - 1 - p)
+        if u_r_min > u_r_max:
+            return None, -1.
+        top = max(v - p - self.b, 0)
+        bot = min(v + p + self.b + 1, im_h)
+        patch = self.to_gray(im_l[v - p:v + p + 1, u - p:u + p + 1])
+        band = self.to_gray(im_r[top:bot, u_r_min - p:u_r_max + p + 1])
+        scores = cv.matchTemplate(band, patch, cv.TM_CCOEFF_NORMED)
+        scores = np.nan_to_num(scores, nan=-1.).max(axis=0) # Best row of the band
+        ind_best = int(np.argmax(scores))
+        return u - (u_r_min + ind_best), float(scores[ind_best])
+
+
+    def suggest(self, im_l, im_r, u, v, disp_prior=None):
+        """ Column `u_r` of the suggested right kpt, or `None` if no good match is found """
+        t_start = time.perf_counter()
+        disp, score = None, -1.
+        if disp_prior is not None:
+            disp, score = self.search(im_l, im_r, u, v,
+                                      max(disp_prior - self.prior_half, 1),
+                                      min(disp_prior + self.prior_half, self.max_disp))
+        if score < self.min_score:
+            disp, score = self.search(im_l, im_r, u, v, 1, self.max_disp)
+        self.n_searches += 1
+        self.t_search += time.perf_counter() - t_start
+        if disp is None or score < self.min_score:
+            return None
+        return u - disp
+
+
+    def get_stats_txt(self):
+        return "Match suggestions: {} searches, {:.2f} ms on average".format(
+               self.n_searches,
+               1000. * self.t_search / max(self.n_searches, 1))
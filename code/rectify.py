@@ -0,0 +1,86 @@
+import hashlib
+import os
+
+import cv2 as cv
+import numpy as np
+from code import utils
+
+
+MAP_TYPES = ["float", "fixed"]
+MATRIX_KEYS = ["R1", "R2", "P1", "P2", "Q"]
+MAP_KEYS = ["map1_x", "map1_y", "map2_x", "map2_y"] # Only needed to rectify new frames
+
+
+def get_file_hash(path):
+    h = hashlib.sha1()
+    with open(path, "rb") as f_tmp:
+        for chunk in iter(lambda: f_tmp.read(1024 * 1024), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def get_str_hash(txt):
+    return hashlib.sha1(txt.encode()).hexdigest()
+
+
+class RectCache:
+    """
+     Rectification data saved on disk, so that it is only computed the first time a dataset is opened:
+      - `video_<hash>.yaml`: image size of a video, keyed by its path, size and modification time;
+      - `rect_<hash>/`: rectification matrices and maps, keyed by the content of the calibration
+         file, the image size and the map type. One `.npy` file per array, so that the maps are
+         only loaded (memory-mapped) when frames need to be rectified.
+    """
+    def __init__(self, dir_cache):
+        self.dir_cache = dir_cache
+        if not os.path.isdir(dir_cache):
+            os.makedirs(dir_cache)
+
+
+    def get_video_path(self, vid_path, stack_type):
+        st = os.stat(vid_path)
+        key = get_str_hash("{}|{}|{}|{}".format(os.path.abspath(vid_path), st.st_size, st.st_mtime_ns, stack_type))
+        return os.path.join(self.dir_cache, "video_{}.yaml".format(key))
+
+
+    def load_im_size(self, vid_path, stack_type):
+        """ (im_h, im_w) of each stereo image, or `None` if not in the cache """
+        path = self.get_video_path(vid_path, stack_type)
+        if not os.path.isfile(path):
+            return None
+        data = utils.load_yaml_data(path)
+        return data["im_h"], data["im_w"]
+
+
+    def save_im_size(self, vid_path, stack_type, im_h, im_w):
+        path = self.get_video_path(vid_path, stack_type)
+        utils.write_yaml_data(path, {"im_h": im_h, "im_w": im_w})
+
+
+    def get_rect_dir(self, calib_path, im_h, im_w, map_type):
+        key = get_str_hash("{}|{}x{}|{}|{}".format(get_file_hash(calib_path), im_w, im_h, map_type, cv.__version__))
+        return os.path.join(self.dir_cache, "rect_{}".format(key))
+
+
+    def load_rect(self, dir_rect, keys):
+        """ Dict with the `keys` arrays (e.g. `MATRIX_KEYS`), or `None` if not in the cache """
+        paths = [os.path.join(dir_rect, "{}.npy".format(key)) for key in keys]
+        if not all(os.path.isfile(path) for path in paths):
+            return None
+        data = {}
+        for key, path in zip(keys, paths):
+            # Only the maps are large enough to be worth memory-mapping
+            mmap_mode = "r" if key in MAP_KEYS else None
+            data[key] = np.load(path, mmap_mode=mmap_mode)
+        return data
+
+
+    def save_rect(self, dir_rect, data):
+        if not os.path.isdir(dir_rect):
+            os.makedirs(dir_rect)
+        for key, value in data.items():
+            # Write to a temporary file first, so that a file in `dir_rect` is never left half-written
+            path = os.path.join(dir_rect, "{}.npy".format(key))
+            path_tmp = "{}.tmp.npy".format(path[:-len(".npy")])
+            np.save(path_tmp, value)
+            os.replace(path_tmp, path)
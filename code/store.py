@@ -0,0 +1,425 @@
+import copy
+import glob
+import json
+import os
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
+from natsort import natsorted
+from pathlib import Path
+from code import utils
+
+
+KPT_KEYS = ["u", "v", "is_interp", "is_visible_in_both_stereo", "is_difficult"]
+KPT_BOOL_KEYS = ["is_interp", "is_visible_in_both_stereo", "is_difficult"]
+RETRY_S = 1. # Time between the attempts of `WriteBehindStore` to write, after a failure
+
+
+class YamlStore:
+    """ Two .yaml files per image pair (e.g. `left_kpts/0000.yaml` and `right_kpts/0000.yaml`) """
+    def __init__(self, dir_out_l, dir_out_r):
+        self.dir_out_l = dir_out_l
+        self.dir_out_r = dir_out_r
+        self.create_output_paths()
+
+
+    def create_output_paths(self):
+        if not os.path.isdir(self.dir_out_l):
+            os.mkdir(self.dir_out_l)
+        if not os.path.isdir(self.dir_out_r):
+            os.mkdir(self.dir_out_r)
+
+
+    def get_paths(self, im_name):
+        name_file = "{}.yaml".format(im_name)
+        path_l = os.path.join(self.dir_out_l, name_file)
+        path_r = os.path.join(self.dir_out_r, name_file)
+        return path_l, path_r
+
+
+    def load_kpts_from_file(self, path):
+        if os.path.isfile(path):
+            # Load data from .yaml file
+            data = utils.load_yaml_data(path)
+            if data is not None:
+                return data
+        return {}
+
+
+    def load(self, im_name):
+        path_l, path_r = self.get_paths(im_name)
+        return self.load_kpts_from_file(path_l), self.load_kpts_from_file(path_r)
+
+
+    def save(self, im_name, kpts_l, kpts_r):
+        path_l, path_r = self.get_paths(im_name)
+        utils.write_yaml_data(path_l, kpts_l)
+        utils.write_yaml_data(path_r, kpts_r)
+
+
+    def save_many(self, kpts, n_workers=8):
+        """ Save many image pairs, `kpts` is a dict {im_name: (kpts_l, kpts_r)}. The files are written in parallel """
+        with ThreadPoolExecutor(max_workers=n_workers) as pool:
+            list(pool.map(lambda item: self.save(item[0], *item[1]), kpts.items()))
+
+
+    def get_im_names(self):
+        """ Names of the image pairs that have a .yaml file """
+        names = set()
+        for dir_out in [self.dir_out_l, self.dir_out_r]:
+            for path in glob.glob(os.path.join(dir_out, "*.yaml")):
+                names.add(Path(path).stem)
+        return natsorted(names)
+
+
+    @contextmanager
+    def transaction(self):
+        # Each file is written straight away
+        yield
+
+
+    def request_flush(self):
+        pass
+
+
+    def flush(self):
+        pass
+
+
+    def close(self):
+        pass
+
+
+class SqliteStore:
+    """
+     All the keypoints in a single SQLite database, one row per (frame, id, side).
+
+     A key that is missing from a keypoint (e.g. `u` when the keypoint was only marked
+      as not visible) is stored as NULL, so that the .yaml layout can be recovered.
+    """
+    def __init__(self, path_db):
+        self.path_db = path_db
+        self.lock = threading.RLock()
+        self.depth = 0 # Depth of nested transactions
+        self.con = sqlite3.connect(path_db, isolation_level=None, check_same_thread=False)
+        self.con.execute("PRAGMA journal_mode=WAL")
+        self.con.execute("PRAGMA synchronous=NORMAL")
+        self.con.execute("CREATE TABLE IF NOT EXISTS kpts ("
+                         " frame TEXT NOT NULL,"
+                         " id INTEGER NOT NULL,"
+                         " is_left INTEGER NOT NULL,"
+                         " u, v, is_interp, is_visible_in_both_stereo, is_difficult,"
+                         " PRIMARY KEY (frame, id, is_left))")
+        self.con.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)")
+
+
+    @contextmanager
+    def transaction(self):
+        """ Updates inside a transaction are either all saved, or none of them """
+        with self.lock:
+            if self.depth == 0:
+                self.con.execute("BEGIN")
+            self.depth += 1
+            try:
+                yield
+            except BaseException:
+                self.depth -= 1
+                if self.depth == 0:
+                    self.con.execute("ROLLBACK")
+                raise
+            self.depth -= 1
+            if self.depth == 0:
+                self.con.execute("COMMIT")
+
+
+    def row_to_kpt(self, row):
+        kpt = {}
+        for key, value in zip(KPT_KEYS, row):
+            if value is None:
+                continue
+            if key in KPT_BOOL_KEYS:
+                value = bool(value)
+            kpt[key] = value
+        return kpt
+
+
+    def load(self, im_name):
+        kpts_l = {}
+        kpts_r = {}
+        with self.lock:
+            rows = self.con.execute("SELECT id, is_left, {} FROM kpts WHERE frame = ?"
+                                    " ORDER BY id".format(", ".join(KPT_KEYS)),
+                                    (im_name,)).fetchall()
+        for row in rows:
+            kpt = self.row_to_kpt(row[2:])
+            if row[1]:
+                kpts_l[row[0]] = kpt
+            else:
+                kpts_r[row[0]] = kpt
+        return kpts_l, kpts_r
+
+
+    def save(self, im_name, kpts_l, kpts_r):
+        rows = []
+        for is_left, kpts in [(1, kpts_l), (0, kpts_r)]:
+            for ind_id, kpt in kpts.items():
+                rows.append([im_name, ind_id, is_left] + [kpt.get(key) for key in KPT_KEYS])
+        with self.transaction():
+            self.con.execute("DELETE FROM kpts WHERE frame = ?", (im_name,))
+            self.con.executemany("INSERT INTO kpts VALUES (?, ?, ?, ?, ?, ?, ?, ?)", rows)
+
+
+    def save_many(self, kpts, n_workers=8):
+        """ Same as `YamlStore.save_many()`, in a single transaction (there is a single connection) """
+        with self.transaction():
+            for im_name, (kpts_l, kpts_r) in kpts.items():
+                self.save(im_name, kpts_l, kpts_r)
+
+
+    def get_im_names(self):
+        with self.lock:
+            rows = self.con.execute("SELECT DISTINCT frame FROM kpts").fetchall()
+        return natsorted(row[0] for row in rows)
+
+
+    def get_meta(self, key):
+        """ Value saved with `set_meta()`, or `None` """
+        with self.lock:
+            row = self.con.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return None if row is None else row[0]
+
+
+    def set_meta(self, key, value):
+        with self.transaction():
+            self.con.execute("INSERT OR REPLACE INTO meta VALUES (?, ?)", (key, value))
+
+
+    def request_flush(self):
+        pass
+
+
+    def flush(self):
+        pass
+
+
+    def close(self):
+        with self.lock:
+            self.con.close()
+
+
+class WriteBehindStore:
+    """
+     Saves the keypoints in a background thread, instead of on the UI thread.
+
+     Each `save()` is appended to a journal file and the image pair is marked as dirty.
+     Repeated edits of the same image pair, within `delay_s` seconds, are coalesced
+      into a single write. If the tool crashes before writing, the journal is
+      replayed the next time the store is opened.
+     If a write fails, it is retried every `RETRY_S` seconds, and `flush()` raises the error.
+    """
+    def __init__(self, store, path_journal, delay_s):
+        self.store = store
+        self.path_journal = path_journal
+        self.delay_s = delay_s
+        self.pending = {} # im_name -> (kpts_l, kpts_r), not yet written
+        self.writing = {} # im_name -> (kpts_l, kpts_r), being written
+        self.t_last_save = 0.
+        self.is_flush_requested = False
+        self.is_closed = False
+        self.depth = 0 # Depth of nested transactions, nothing is written while > 0
+        self.error = None # Last exception of the background thread, raised by `flush()`
+        self.t_retry = 0.
+        self.cond = threading.Condition()
+        self.replay_journal()
+        self.f_journal = open(path_journal, "a")
+        self.thread = threading.Thread(target=self.write_loop, daemon=True)
+        self.thread.start()
+
+
+    def replay_journal(self):
+        if not os.path.isfile(self.path_journal):
+            return
+        data = {}
+        with open(self.path_journal) as f_tmp:
+            for line in f_tmp:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    break # Line truncated by the crash
+                data[entry["im_name"]] = (dict(entry["kpts_l"]), dict(entry["kpts_r"]))
+        if data:
+            with self.store.transaction():
+                for im_name, (kpts_l, kpts_r) in data.items():
+                    self.store.save(im_name, kpts_l, kpts_r)
+            print("Recovered the unsaved keypoints of {} image pairs from {}".format(len(data), self.path_journal))
+        os.remove(self.path_journal)
+
+
+    def write_journal(self, im_name, kpts_l, kpts_r):
+        entry = {"im_name": im_name,
+                 "kpts_l": list(kpts_l.items()),
+                 "kpts_r": list(kpts_r.items())}
+        self.f_journal.write(json.dumps(entry) + "\n")
+        self.f_journal.flush()
+        # On disk before `save()` returns, so that an edit is not lost even if the OS crashes
+        os.fsync(self.f_journal.fileno())
+
+
+    def save(self, im_name, kpts_l, kpts_r):
+        kpts = (copy.deepcopy(kpts_l), copy.deepcopy(kpts_r))
+        with self.cond:
+            self.write_journal(im_name, *kpts)
+            self.pending[im_name] = kpts
+            self.t_last_save = time.monotonic()
+            self.cond.notify_all()
+
+
+    def save_many(self, kpts, n_workers=8):
+        kpts = {im_name: copy.deepcopy(kpts_pair) for im_name, kpts_pair in kpts.items()}
+        with self.cond:
+            for im_name, kpts_pair in kpts.items():
+                self.write_journal(im_name, *kpts_pair)
+            self.pending.update(kpts)
+            self.t_last_save = time.monotonic()
+            self.cond.notify_all()
+
+
+    def load(self, im_name):
+        with self.cond:
+            kpts = self.pending.get(im_name, self.writing.get(im_name))
+            if kpts is not None:
+                return copy.deepcopy(kpts[0]), copy.deepcopy(kpts[1])
+        return self.store.load(im_name)
+
+
+    def get_im_names(self):
+        with self.cond:
+            names = set(self.pending) | set(self.writing)
+        return natsorted(names | set(self.store.get_im_names()))
+
+
+    def is_ready_to_write(self):
+        if not self.pending or self.depth > 0:
+            return False
+        if time.monotonic() < self.t_retry:
+            return False
+        if self.is_flush_requested or self.is_closed:
+            return True
+        return time.monotonic() - self.t_last_save >= self.delay_s
+
+
+    def write_loop(self):
+        while True:
+            with self.cond:
+                while not self.is_ready_to_write():
+                    if self.is_closed and not self.pending:
+                        return
+                    self.cond.wait(timeout=self.delay_s)
+                self.writing = self.pending
+                self.pending = {}
+                self.is_flush_requested = False
+            try:
+                with self.store.transaction():
+                    self.store.save_many(self.writing)
+            except Exception as e:
+                with self.cond:
+                    # Still in the journal, so they are written again later (or when it is replayed)
+                    self.writing.update(self.pending)
+                    self.pending = self.writing
+                    self.writing = {}
+                    self.error = e
+                    self.t_retry = time.monotonic() + RETRY_S
+                    self.cond.notify_all()
+                    if self.is_closed:
+                        return
+                continue
+            with self.cond:
+                self.writing = {}
+                self.error = None
+                if not self.pending and self.depth == 0:
+                    # Everything in the journal is now saved
+                    self.f_journal.truncate(0)
+                    self.f_journal.seek(0)
+                self.cond.notify_all()
+
+
+    def request_flush(self):
+        """ Start writing the dirty image pairs now, without waiting for them """
+        with self.cond:
+            self.is_flush_requested = True
+            self.cond.notify_all()
+
+
+    def flush(self):
+        """ Write the dirty image pairs and wait until they are saved, raises the error if a write fails """
+        with self.cond:
+            self.is_flush_requested = True
+            self.t_retry = 0.
+            self.cond.notify_all()
+            while self.pending or self.writing:
+                if self.error is not None:
+                    error = self.error
+                    self.error = None
+                    raise error
+                self.cond.wait()
+
+
+    @contextmanager
+    def transaction(self):
+        # The edits inside the transaction are written together, after it finishes
+        with self.cond:
+            self.depth += 1
+        try:
+            yield
+        finally:
+            with self.cond:
+                self.depth -= 1
+                self.cond.notify_all()
+
+
+    def close(self):
+        with self.cond:
+            self.is_closed = True
+            self.cond.notify_all()
+        self.thread.join()
+        self.f_journal.close()
+        if self.error is not None:
+            print("Error: failed to save the keypoints ({}), they will be recovered from {}".format(self.error, self.path_journal))
+        if os.path.isfile(self.path_journal) and os.path.getsize(self.path_journal) == 0:
+            os.remove(self.path_journal)
+        self.store.close()
+
+
+def copy_kpts(store_src, store_dst):
+    """ Copy all the keypoints from one store to another, e.g. to migrate a dataset """
+    im_names = store_src.get_im_names()
+    with store_dst.transaction():
+        for im_name in im_names:
+            kpts_l, kpts_r = store_src.load(im_name)
+            store_dst.save(im_name, kpts_l, kpts_r)
+    return len(im_names)
+
+
+def open_store(kpt_store, dir_out_l, dir_out_r, path_db, path_journal=None, delay_s=0.):
+    """ If `path_journal` is set, the keypoints are saved in the background """
+    store = YamlStore(dir_out_l, dir_out_r)
+    if kpt_store == "sqlite":
+        store_yaml = store
+        store = SqliteStore(path_db)
+        if store.get_meta("is_yaml_imported") is None:
+            # Import the existing .yaml keypoints. The marker is saved in the same transaction,
+            #  so an interrupted import is done again the next time
+            with store.transaction():
+                # A database from before the marker, with keypoints, was already imported
+                n_im = 0
+                if not store.get_im_names():
+                    n_im = copy_kpts(store_yaml, store)
+                store.set_meta("is_yaml_imported", "1")
+            if n_im > 0:
+                print("Imported the keypoints of {} image pairs into {}".format(n_im, path_db))
+    if path_journal is not None:
+        store = WriteBehindStore(store, path_journal, delay_s)
+    return store
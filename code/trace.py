@@ -0,0 +1,98 @@
+import functools
+import json
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+
+import numpy as np
+
+
+HIST_BINS_MS = [0.1, 0.3, 1., 3., 10., 30., 100., 300., 1000.] # Upper edges of the histogram bins
+
+
+class Tracer:
+    """
+     Opt-in timing of the interface's hot paths, to find where the time goes when it feels slow.
+
+     Each timed call is an event, with a latency histogram per event name. Optionally, all the
+      events are also kept to be saved as a Chrome trace (open it in `chrome://tracing` or Perfetto).
+     While disabled, the timed functions only check a flag.
+    """
+    def __init__(self):
+        self.is_enabled = False
+        self.is_chrome_trace = False
+        self.t_0 = time.perf_counter()
+        self.durations = defaultdict(list) # Event name -> durations in [seconds]
+        self.events = []
+        self.lock = threading.Lock()
+
+
+    def enable(self, is_chrome_trace):
+        self.is_enabled = True
+        self.is_chrome_trace = is_chrome_trace
+
+
+    def add(self, name, t_start, t_end):
+        with self.lock:
+            self.durations[name].append(t_end - t_start)
+            if self.is_chrome_trace:
+                self.events.append({"name": name,
+                                    "ph": "X", # Complete event, with a duration
+                                    "ts": 1e6 * (t_start - self.t_0),
+                                    "dur": 1e6 * (t_end - t_start),
+                                    "pid": 0,
+                                    "tid": threading.get_ident()})
+
+
+    @contextmanager
+    def span(self, name):
+        if not self.is_enabled:
+            yield
+            return
+        t_start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(name, t_start, time.perf_counter())
+
+
+    def get_histograms_txt(self):
+        header = "<=" + " <=".join("{:g}".format(edge) for edge in HIST_BINS_MS) + " >{:g} [ms]".format(HIST_BINS_MS[-1])
+        lines = ["Latency per event: n, mean, p50, p95, max [ms] | counts {}".format(header)]
+        with self.lock:
+            durations = {name: 1000. * np.array(d) for name, d in self.durations.items()}
+        for name, d_ms in sorted(durations.items()):
+            counts = np.bincount(np.searchsorted(HIST_BINS_MS, d_ms), minlength=len(HIST_BINS_MS) + 1)
+            lines.append("  {:<36} {:>6} {:>8.2f} {:>8.2f} {:>8.2f} {:>8.2f} | {}".format(
+                         name,
+                         len(d_ms),
+                         d_ms.mean(),
+                         np.percentile(d_ms, 50),
+                         np.percentile(d_ms, 95),
+                         d_ms.max(),
+                         " ".join(str(c) for c in counts)))
+        return "\n".join(lines)
+
+
+    def save_chrome_trace(self, path):
+        with self.lock:
+            events = list(self.events)
+        with open(path, "w") as f_tmp:
+            json.dump({"traceEvents": events, "displayTimeUnit": "ms"}, f_tmp)
+
+
+TRACER = Tracer()
+
+
+def timed(name):
+    """ Decorator adding an event to `TRACER` at every call, if enabled """
+    def decorator(f):
+        @functools.wraps(f)
+        def wrapper(*args, **kwargs):
+            if not TRACER.is_enabled:
+                return f(*args, **kwargs)
+            with TRACER.span(name):
+                return f(*args, **kwargs)
+        return wrapper
+    return decorator
@@ -1,5 +1,8 @@
+import errno
 import os
+import threading
 import yaml
+from collections import OrderedDict
 
 
 def is_path_file(string):
@@ -16,5 +19,64 @@ def load_yaml_data(path):
 
 
 def write_yaml_data(path, data):
-    with open(path, 'w') as fp:
+    # Write to a temporary file first, so that `path` is never left half-written
+    path_tmp = "{}.tmp".format(path)
+    with open(path_tmp, 'w') as fp:
         yaml.dump(data, fp)
+        fp.flush()
+        os.fsync(fp.fileno())
+    os.replace(path_tmp, path)
+
+
+def get_n_bytes(value):
+    if isinstance(value, (tuple, list)):
+        return sum(get_n_bytes(v) for v in value)
+    return getattr(value, "nbytes", 0)
+
+
+class LRUCache:
+    """ Keeps the most recently used items, up to `max_size` items and `max_bytes` bytes """
+    def __init__(self, max_size=None, max_bytes=None):
+        self.max_size = max_size
+        self.max_bytes = max_bytes
+        self.n_bytes = 0
+        self.data = OrderedDict()
+        self.lock = threading.Lock()
+
+
+    def __contains__(self, key):
+        return key in self.data
+
+
+    def get(self, key):
+        with self.lock:
+            value = self.data.get(key)
+            if value is not None:
+                self.data.move_to_end(key)
+            return value
+
+
+    def is_full(self):
+        if self.max_size is not None and len(self.data) > self.max_size:
+            return True
+        if self.max_bytes is not None and self.n_bytes > self.max_bytes:
+            return True
+        return False
+
+
+    def put(self, key, value):
+        with self.lock:
+            old_value = self.data.pop(key, None)
+            if old_value is not None:
+                self.n_bytes -= get_n_bytes(old_value)
+            self.data[key] = value
+            self.n_bytes += get_n_bytes(value)
+            while len(self.data) > 1 and self.is_full():
+                _key, old_value = self.data.popitem(last=False)
+                self.n_bytes -= get_n_bytes(old_value)
+
+
+    def clear(self):
+        with self.lock:
+            self.data.clear()
+            self.n_bytes = 0
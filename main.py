@@ -1,14 +1,54 @@
+import time
+T_LAUNCH = time.perf_counter() # Before the other imports, to include them in the time to the first frame
 import argparse
+import sys
 from code.utils import load_yaml_data
-from code.label import label_data
+from code.batch import run_batch
+from code.label import label_data, download_video_frames_and_rectify, interpolate_all, export_gt, validate, export_kpts_to_yaml
+
+
+def run_command(command, config, args):
+    """ Returns `True` if the command succeeded """
+    if command == "label":
+        label_data(config, T_LAUNCH)
+    elif command == "extract":
+        download_video_frames_and_rectify(config)
+    elif command == "interp":
+        interpolate_all(config)
+    elif command == "gt":
+        export_gt(config, args.id)
+    elif command == "validate":
+        return validate(config)
+    elif command == "export-yaml":
+        export_kpts_to_yaml(config)
+    elif command == "batch":
+        return run_batch(config, args.configs, args.dirs)
+    return True
 
 
 def main():
     parser = argparse.ArgumentParser(description='Tool to label stereo matches')
     parser.add_argument('--config', type=str, default='config.yaml')
+    subparsers = parser.add_subparsers(dest='command',
+                                       help='Default: label. All the others run without a display')
+    subparsers.add_parser('label', help='Open the labelling interface')
+    subparsers.add_parser('extract', help='Extract and rectify the video frames')
+    subparsers.add_parser('interp', help='Interpolate all the gaps in between labelled keypoints, of all ids')
+    parser_gt = subparsers.add_parser('gt', help='Write the ground-truth bounding boxes')
+    parser_gt.add_argument('--id', type=int, default=None, help='Only this id, instead of all ids')
+    subparsers.add_parser('validate', help='Check the keypoints, bounding boxes and extracted frames, exit code 1 if any is invalid')
+    subparsers.add_parser('export-yaml', help='Export the keypoints database into the .yaml layout')
+    parser_batch = subparsers.add_parser('batch', help='Extract the frames and write the ground-truth of many datasets')
+    parser_batch.add_argument('--configs', type=str, nargs='+', default=None, help='A config file per dataset')
+    parser_batch.add_argument('--dirs', type=str, default=None,
+                              help='Glob of dataset dirs (e.g. "data/*"), each one used as `data.dir` of --config')
     args = parser.parse_args()
     config = load_yaml_data(args.config)
-    label_data(config)
+    command = args.command or "label"
+    t_start = time.perf_counter()
+    is_ok = run_command(command, config, args)
+    print("{} {} in {:.1f} s".format(command, "finished" if is_ok else "failed", time.perf_counter() - t_start))
+    sys.exit(0 if is_ok else 1)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,94 @@
+"""
+ Run from the repository's root with: python -m unittest discover tests
+"""
+import os
+import unittest
+
+import cv2 as cv
+import numpy as np
+from code.label import GT, Video
+
+
+DIR_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+CALIB_PATH = os.path.join(DIR_ROOT, "data", "calibration.yaml")
+IM_H, IM_W = 1024, 1280 # Resolution of the video of that calibration
+RADIUS = 2.5
+N_SPHERES = 2000
+
+
+class Images:
+    def get_resolution(self):
+        return IM_H, IM_W
+
+
+def get_gt():
+    v = Video.__new__(Video) # Only the rectification, without loading the video
+    v.load_calib_data(CALIB_PATH)
+    v.im_h, v.im_w = IM_H, IM_W
+    v.stereo_rectify()
+    return GT(v, Images(), None, RADIUS, "gt_{}.yaml")
+
+
+def get_n_outline_pieces(G, P, kpt_3d):
+    """ Number of pieces of the drawn ellipse, more than 1 if the image borders cut it """
+    H_inv = np.hstack((G.H_inv, kpt_3d))
+    ellipse = G.get_ellipse_param(P, H_inv.T @ G.Q @ H_inv, P.T)
+    centre_x, centre_y, a, b, angle = ellipse
+    mask = np.zeros((IM_H, IM_W), dtype=np.uint8)
+    mask = cv.ellipse(mask,
+                      (int(round(centre_x)), int(round(centre_y))),
+                      (int(round(b)), int(round(a))),
+                      angle,
+                      startAngle=0,
+                      endAngle=360,
+                      color=(255),
+                      thickness=1)
+    contours, _ = cv.findContours(mask, cv.RETR_EXTERNAL, cv.CHAIN_APPROX_SIMPLE)
+    return len(contours)
+
+
+class TestBboxs(unittest.TestCase):
+    def test_closed_form_matches_raster(self):
+        """ Random spheres, with both kpts in the image (including close to the borders) """
+        G = get_gt()
+        rng = np.random.default_rng(0)
+        n_checked = 0
+        for _ in range(N_SPHERES):
+            disp = int(rng.integers(5, 200))
+            k_l = {"u": int(rng.integers(disp, IM_W)), "v": int(rng.integers(0, IM_H))}
+            k_r = {"u": k_l["u"] - disp, "v": k_l["v"]}
+            kpt_3d = G.get_kpt_3d_pt(k_l, k_r)
+            bboxs = G.project_sphere_around_kpt(kpt_3d, k_l, k_r)
+            bboxs_raster = G.project_sphere_around_kpt_raster(kpt_3d, k_l, k_r)
+            # The right ellipse is drawn with the right camera as the origin (see `project_sphere_around_kpt_raster()`)
+            kpt_3d_r = kpt_3d.copy()
+            kpt_3d_r[0, 0] -= G.baseline
+            P2 = G.P2.copy()
+            P2[:, 3] = 0
+            for P, pt_3d, bbox, bbox_raster in zip([G.P1, P2], [kpt_3d, kpt_3d_r], bboxs, bboxs_raster):
+                # When the borders cut the ellipse in pieces, the raster method only keeps one of them
+                if get_n_outline_pieces(G, P, pt_3d) > 1:
+                    continue
+                n_checked += 1
+                x, y, w, h = np.subtract(bbox, bbox_raster)
+                self.assertLessEqual(max(abs(x), abs(y), abs(x + w), abs(y + h)), 1,
+                                     "{} != {} (kpts {}, {})".format(bbox, bbox_raster, k_l, k_r))
+        self.assertGreater(n_checked, 0.95 * 2 * N_SPHERES)
+
+
+    def test_bbox_cropped_at_border(self):
+        """ A right kpt at the image's corner only gets the bbox of the visible part of its ellipse """
+        G = get_gt()
+        disp = 100
+        k_l = {"u": IM_W // 2, "v": IM_H // 2}
+        k_r = {"u": k_l["u"] - disp, "v": k_l["v"]}
+        _, bbox_centre = G.project_sphere_around_kpt(G.get_kpt_3d_pt(k_l, k_r), k_l, k_r)
+        k_l = {"u": disp, "v": 0}
+        k_r = {"u": 0, "v": 0}
+        _, bbox_corner = G.project_sphere_around_kpt(G.get_kpt_3d_pt(k_l, k_r), k_l, k_r)
+        self.assertLess(bbox_corner[2], bbox_centre[2])
+        self.assertLess(bbox_corner[3], bbox_centre[3])
+
+
+if __name__ == "__main__":
+    unittest.main()